@@ -0,0 +1,13 @@
+"""
+ASGI entry point, needed for the live dashboard stream (/events), everything else works on either:
+
+    pip install uvicorn
+    uvicorn asgi:application --port 7001
+"""
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+application = get_asgi_application()
@@ -2,6 +2,7 @@
 I treat admin like part of the application, some things you can only do there.
 """
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.models import Group, User
 from django.db import models
 from django.forms import CharField, ModelForm, Textarea, TextInput
@@ -10,7 +11,7 @@ from mptt.admin import DraggableMPTTAdmin
 from pytimeparse import parse as to_seconds
 
 from core.fields import ColorField
-from core.models import Bucket, DailyTarget, TimeSpan
+from core.models import Bucket, BucketDayTotal, DailyTarget, Rollup, TimeSpan
 from core.utils import draw_progress_bar, to_human_readable_in_hours
 
 
@@ -41,6 +42,15 @@ class TimeSpanInline(admin.TabularInline):
     }
 
 
+class BucketChangeList(ChangeList):
+    def get_results(self, request):
+        """Totals for the whole page from one pass over the rollup table, see BucketAdmin.rollup."""
+        super().get_results(request)
+        rollup = BucketDayTotal.rollup([obj.id for obj in self.result_list])
+        for obj in self.result_list:
+            obj.rollup = rollup.get(obj.id, Rollup.EMPTY)
+
+
 class BucketAdmin(DraggableMPTTAdmin):
     mptt_level_indent = 20
     mptt_indent_field = "title"
@@ -65,12 +75,20 @@ class BucketAdmin(DraggableMPTTAdmin):
     ]
     search_fields = ['title']
 
+    def get_changelist(self, request, **kwargs):
+        return BucketChangeList
+
+    def rollup(self, obj):
+        """Precomputed by BucketChangeList, calculated here only when used outside of it."""
+        if not hasattr(obj, 'rollup'):
+            obj.rollup = BucketDayTotal.rollup([obj.id]).get(obj.id, Rollup.EMPTY)
+        return obj.rollup
+
     def local_total(self, obj):
-        count = obj.timespan_set.count()
-        if not count:
+        rollup = self.rollup(obj)
+        if not rollup.local_count:
             return ''
-        merged = obj.timespan_set.merged_total()
-        return '%s (%s)' % (to_human_readable_in_hours(merged), count)
+        return '%s (%s)' % (to_human_readable_in_hours(rollup.local), rollup.local_count)
 
     def display_color(self, obj):
         """Color box as a column."""
@@ -84,22 +102,17 @@ class BucketAdmin(DraggableMPTTAdmin):
 
     def display_family_merged(self, obj):
         """Merged time of all timespans in this and all descendants."""
-        family = obj.family_time_spans_q()
-        return '%s (%s)' % (to_human_readable_in_hours(family.merged_total()), family.count())
+        rollup = self.rollup(obj)
+        return '%s (%s)' % (to_human_readable_in_hours(rollup.family), rollup.family_count)
 
     def progress_bar(self, obj):
         estimate = obj.estimate
         if not estimate:
             return ''
-        merged = obj.timespan_set.merged_total()
-        return draw_progress_bar(merged, obj.estimate)
+        return draw_progress_bar(self.rollup(obj).local, obj.estimate)
 
     progress_bar.allow_tags = True
 
-    def get_queryset(self, request):
-        qs = super(BucketAdmin, self).get_queryset(request)
-        return qs.prefetch_related('timespan_set')
-
     def timespans(self, obj):
         # performance killer, debug only
         return '<br>'.join(
@@ -1,22 +1,138 @@
-def merge_overlapping_spans(spans):
+try:
+    import numpy as np
+except ImportError:  # optional, pure python is used instead
+    np = None
+
+from core.metrics import timed
+
+
+def iter_merged_spans(spans, presorted=False):
+    """Yield merged spans one by one, see `merge_overlapping_spans`.
+
+    Pass `presorted=True` when `spans` already come ordered by start (for example from a queryset
+    with `order_by('start')`), the input is then consumed as a stream in O(n), nothing is copied.
+    Otherwise it is sorted first, O(n log n).
+    """
+    if not presorted:
+        # willfully consume a possible generator
+        spans = sorted(spans)
+    spans = iter(spans)
+    for cur_start, cur_end in spans:
+        break
+    else:
+        return
+    for start, end in spans:
+        if cur_end < start:
+            yield cur_start, cur_end
+            cur_start, cur_end = start, end
+        elif cur_end < end:
+            cur_end = end
+    yield cur_start, cur_end
+
+
+def merge_overlapping_spans(spans, presorted=False):
     """When dealing with overlapping time spans, calculate total time spent treating overlapping
     periods as one. For example:
     I've been coding at the office since 10:30 until 11:48. (78 minutes)
     But really, at 11:30 we started lunch and discussion which lasted till 12:15. (45 minutes)
     Then I went home to have a siesta. I have worked for 105 minutes, not 123.
     """
-    # willfully consume a possible generator
-    sorted_spans = sorted(spans)
-    if not sorted_spans:
-        return []
-    stack = [sorted_spans.pop(0)]
-    try:
-        while True:
-            cur = sorted_spans.pop(0)
-            if stack[-1][1] < cur[0]:
-                stack.append(cur)
-            else:
-                if stack[-1][1] < cur[1]:
-                    stack[-1] = stack[-1][0], cur[1]
-    except IndexError:
-        return stack
+    return list(iter_merged_spans(spans, presorted))
+
+
+def merged_length(spans, presorted=False):
+    """Total length of merged spans, same as summing `merge_overlapping_spans` but without
+    building the list."""
+    if not presorted:
+        spans = sorted(spans)
+    total = 0
+    cur_end = None
+    for start, end in spans:
+        if cur_end is None or cur_end < start:
+            total += end - start
+            cur_end = end
+        elif cur_end < end:
+            total += end - cur_end
+            cur_end = end
+    return total
+
+
+def focus_lengths(rows):
+    """Merged length of all spans and of the focused ones among them, per key, in one pass.
+
+    rows: iterable of (key, start, end, focused), sorted by key and then by start, like spans
+        ordered by start and keyed by their day
+    return: {key: (focused length, total length)}
+    """
+    result = {}
+    key = None
+    total = focused_total = 0
+    for row_key, start, end, focused in rows:
+        if row_key != key:
+            if key is not None:
+                result[key] = (focused_total, total)
+            key = row_key
+            total = focused_total = 0
+            cur_end = focused_end = None
+        if cur_end is None or cur_end < start:
+            total += end - start
+            cur_end = end
+        elif cur_end < end:
+            total += end - cur_end
+            cur_end = end
+        if not focused:
+            continue
+        if focused_end is None or focused_end < start:
+            focused_total += end - start
+            focused_end = end
+        elif focused_end < end:
+            focused_total += end - focused_end
+            focused_end = end
+    if key is not None:
+        result[key] = (focused_total, total)
+    return result
+
+
+@timed('grouped_merged_lengths')
+def grouped_merged_lengths(rows, use_numpy=None):
+    """Like `merged_length` but for many groups at once.
+
+    rows: iterable of (key, start, end)
+    return: {key: merged length}
+
+    With NumPy all groups are merged in one go: sort by (group, start), running maximum of ends
+    tells how much of each span is already covered by spans before it. Groups are shifted apart
+    on the time axis so that the running maximum never leaks from one group to the next.
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    if not use_numpy:
+        groups = {}
+        for key, start, end in rows:
+            groups.setdefault(key, []).append((start, end))
+        return {key: merged_length(spans) for key, spans in groups.items()}
+
+    index = {}
+    group_ids, starts, ends = [], [], []
+    for key, start, end in rows:
+        group_ids.append(index.setdefault(key, len(index)))
+        starts.append(start)
+        ends.append(end)
+    if not index:
+        return {}
+    # integers stay integers, exact, that's why no -inf below
+    g = np.array(group_ids, dtype=np.int64)
+    s = np.array(starts)
+    e = np.array(ends)
+    origin = s.min()
+    shift = g * (max(e.max(), s.max()) - origin + 1)
+    s = s - origin + shift
+    e = e - origin + shift
+    order = np.lexsort((s, g))
+    g, s, e = g[order], s[order], e[order]
+    covered = np.empty_like(e)
+    covered[0] = s[0]
+    np.maximum.accumulate(e[:-1], out=covered[1:])
+    contribution = np.clip(e - np.maximum(s, covered), 0, None)
+    totals = np.bincount(g, weights=contribution, minlength=len(index))
+    return {key: totals[i].item() for key, i in index.items()}
@@ -0,0 +1,132 @@
+"""
+Online SQLite backups, safe while the app is writing, unlike `cp db.sqlite3`.
+
+    path, counts = snapshot('db.sqlite3', 'backups')
+    restore(path, 'db.sqlite3')
+
+Snapshots are named db.sqlite3.<timestamp>, next to each there's a <name>.json manifest with row
+counts per table, `restore` checks the file against it. Only names with exactly this timestamp
+are snapshots, whatever else lives in the directory, like the old `make backup` copies named
+db.sqlite3.<date>.<epoch>, is never listed or rotated.
+"""
+import json
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+PREFIX = 'db.sqlite3.'
+STAMP = '%Y.%m.%d.%H%M%S.%f'
+SNAPSHOT_NAME = re.compile(r'^%s\d{4}\.\d{2}\.\d{2}\.\d{6}\.\d{6}$' % re.escape(PREFIX))
+
+
+class BackupError(Exception):
+    pass
+
+
+def connect_read_only(path):
+    if not os.path.exists(path):
+        raise BackupError('no such file %s' % path)
+    return sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+
+
+def copy(source, target, pages=256, sleep=.005):
+    """sqlite3 online backup API, `pages` at a time. Between steps the source is unlocked, so
+    writers wait for one step at most. When another connection writes mid-way the copy starts
+    over, it's always a consistent picture. A writer busy enough to keep it starting over calls
+    for more pages per step, -1 copies everything in one.
+
+    A target created here is removed when the copy fails, an existing one is left to SQLite,
+    which rolls the unfinished copy back."""
+    created = not os.path.exists(target)
+    try:
+        with closing(connect_read_only(source)) as src, closing(sqlite3.connect(target)) as dst:
+            src.backup(dst, pages=pages, sleep=sleep)
+    except Exception:
+        if created and os.path.exists(target):
+            os.remove(target)
+        raise
+
+
+def verify(path):
+    """integrity_check, then {table: row count}. BackupError when damaged."""
+    db = connect_read_only(path)
+    try:
+        result = db.execute('PRAGMA integrity_check').fetchall()
+        if result != [('ok', )]:
+            raise BackupError('%s: %s' % (path, '; '.join(row[0] for row in result)))
+        tables = [row[0] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY name")]
+        return {table: db.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0]
+                for table in tables}
+    except sqlite3.DatabaseError as e:
+        raise BackupError('%s: %s' % (path, e))
+    finally:
+        db.close()
+
+
+def snapshot(source, directory, vacuum=False, pages=256, sleep=.005):
+    """New verified snapshot of `source` in `directory`.
+
+    vacuum: VACUUM INTO instead of the backup API, a compacted copy without free pages, made in a
+        single read transaction, writers are not blocked in WAL mode only
+    return: (path, {table: row count})
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PREFIX + datetime.now().strftime(STAMP))
+    part = path + '.part'
+    try:
+        if vacuum:
+            with closing(connect_read_only(source)) as src:
+                src.execute('VACUUM INTO ?', (part, ))
+        else:
+            copy(source, part, pages, sleep)
+        counts = verify(part)
+    except Exception:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    os.rename(part, path)
+    with open(path + '.json', 'w') as f:
+        json.dump(counts, f, indent=1, sort_keys=True)
+    return path, counts
+
+
+def snapshots(directory):
+    """Snapshot paths, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if SNAPSHOT_NAME.match(name)
+    )
+
+
+def rotate(directory, keep):
+    """Delete all but the `keep` newest snapshots, return the deleted paths."""
+    old = snapshots(directory)[:-keep] if keep else []
+    for path in old:
+        os.remove(path)
+        if os.path.exists(path + '.json'):
+            os.remove(path + '.json')
+    return old
+
+
+def check(path):
+    """`verify` and compare with the manifest, when there is one."""
+    counts = verify(path)
+    if os.path.exists(path + '.json'):
+        with open(path + '.json') as f:
+            expected = json.load(f)
+        if counts != expected:
+            raise BackupError('%s: row counts differ from %s.json' % (path, path))
+    return counts
+
+
+def restore(path, target, pages=256, sleep=.005):
+    """Check the snapshot and copy it over `target`, online, like `copy`."""
+    counts = check(path)
+    copy(path, target, pages, sleep)
+    return counts
@@ -0,0 +1,116 @@
+"""
+Live dashboard updates, pushed as Server-Sent Events by views.event_stream.
+
+Writes call `span` or `insight`, once their transaction commits the change is encoded, once, and
+handed to every open stream:
+
+    event: span
+    data: {"action": "stop", "id": 12, "event": {...FullCalendar event...}}
+
+    event: insight
+    data: {"since": "2018-03-05", "days": {"2018-03-05": {...same as /insight...}}}
+
+Nothing is built when nobody listens. Subscribers live in this process only, with
+settings.KINRO_JOBS = 'worker' insight is recalculated elsewhere and never pushed, the dashboard
+catches up on the next page load.
+"""
+import asyncio
+import threading
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.timezone import now
+
+# a client this far behind is told to start over
+MAXSIZE = 256
+# insight days pushed after a change, cumulative values carry forward, a week is what's on screen
+INSIGHT_DAYS = 7
+
+RESET = 'event: reset\ndata: {}\n\n'
+
+_subscribers = set()
+_lock = threading.Lock()
+_encoder = DjangoJSONEncoder()
+
+
+class Subscription:
+    """One open stream. Filled from any thread, read in the event loop it was created in."""
+
+    def __init__(self, maxsize=MAXSIZE):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        with _lock:
+            _subscribers.discard(self)
+
+    def __enter__(self):
+        with _lock:
+            _subscribers.add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def listening():
+    return bool(_subscribers)
+
+
+def sse(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, _encoder.encode(data))
+
+
+def broadcast(event, data):
+    message = sse(event, data)
+    with _lock:
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.put(message)
+        except RuntimeError:  # its loop is closed, the stream is gone
+            subscriber.close()
+
+
+def span(action, pk):
+    """Span `pk` was started, stopped, edited or deleted, published after commit."""
+    if listening():
+        transaction.on_commit(lambda: broadcast('span', span_data(action, pk)))
+
+
+def insight(since):
+    """DayCache changed from `since` on, published after commit."""
+    if listening():
+        transaction.on_commit(lambda: broadcast('insight', insight_data(since)))
+
+
+def span_data(action, pk):
+    from core.models import Bucket, TimeSpan
+    from core.views import time_span_to_json
+    if action == 'delete':
+        return {'action': action, 'id': pk, 'event': None}
+    running_id = TimeSpan.objects.filter(
+        bucket__type=Bucket.FOCUSED, end__isnull=True).values_list('id', flat=True).first()
+    events = list(time_span_to_json(TimeSpan.objects.filter(pk=pk), running_id))
+    return {'action': action, 'id': pk, 'event': events[0] if events else None}
+
+
+def insight_data(since):
+    from core.models import DayCache
+    until = min(since + timedelta(days=INSIGHT_DAYS - 1), now().date())
+    return {'since': since, 'days': DayCache.insight(since, until)}
@@ -0,0 +1,54 @@
+"""
+Catching up with derived data off the request path, see StaleDay.
+
+With settings.KINRO_JOBS = 'thread' a daemon thread, started on first use, is woken after every
+commit that marked a day stale. It waits a moment for the rest of a burst, like 50 admin edits
+or an import, and then updates everything at once. Any marks left by a previous process are
+picked up on the first wake.
+
+With 'worker' the same runs in `./manage.py kinro_worker`, polling.
+"""
+import logging
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for more marks before catching up
+DELAY = .5
+
+_wake = threading.Event()
+_worker = None
+_lock = threading.Lock()
+
+
+def catch_up():
+    """StaleDay.catch_up with errors logged, not raised. Returns the number of marks."""
+    from core.models import StaleDay
+    close_old_connections()
+    try:
+        return StaleDay.catch_up()
+    except Exception:
+        logger.exception('catching up failed, marks are kept for the next run')
+        return 0
+    finally:
+        close_old_connections()
+
+
+def work():
+    while True:
+        _wake.wait()
+        time.sleep(DELAY)
+        _wake.clear()
+        catch_up()
+
+
+def wake():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=work, name='kinro-jobs', daemon=True)
+            _worker.start()
+    _wake.set()
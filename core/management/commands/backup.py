@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import backup
+
+
+def database_path():
+    if connection.vendor != 'sqlite':
+        raise CommandError('sqlite only, use your database tools')
+    path = settings.DATABASES['default']['NAME']
+    if path == ':memory:' or not os.path.exists(path):
+        raise CommandError('no database file %s' % path)
+    return path
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the database while the app keeps running, verify it, rotate old ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=os.path.join(settings.BASE_DIR, 'backups'))
+        parser.add_argument('--keep', type=int, default=30, help='snapshots to keep, 0 keeps all')
+        parser.add_argument(
+            '--vacuum', action='store_true', help='compacted copy with VACUUM INTO')
+        parser.add_argument(
+            '--pages', type=int, default=256, help='pages copied per step, -1 for all at once')
+        parser.add_argument('--verify', metavar='SNAPSHOT', help='only check this snapshot')
+
+    def handle(self, *args, **options):
+        try:
+            if options['verify']:
+                path, counts = options['verify'], backup.check(options['verify'])
+            else:
+                path, counts = backup.snapshot(
+                    database_path(), options['dir'], options['vacuum'], options['pages'])
+                for old in backup.rotate(options['dir'], options['keep']):
+                    self.stdout.write('removed %s' % old)
+        except backup.BackupError as e:
+            raise CommandError(e)
+        self.stdout.write('%s ok, %s rows' % (path, sum(counts.values())))
+        if options['verbosity'] > 1:
+            for table, count in sorted(counts.items()):
+                self.stdout.write('%10d %s' % (count, table))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from core import transfer
+from core.models import BucketTree, TimeSpan
+
+
+class Command(BaseCommand):
+    help = 'Stream time spans out as CSV or NDJSON, see core.transfer for the columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=transfer.FORMATS, default='csv')
+        parser.add_argument('--output', '-o', help='file, stdout by default')
+        parser.add_argument('--since', type=parse_date, help='YYYY-MM-DD')
+        parser.add_argument('--until', type=parse_date, help='YYYY-MM-DD')
+        parser.add_argument('--bucket', type=int, help='bucket id, descendants included')
+
+    def handle(self, *args, **options):
+        spans = TimeSpan.objects.all()
+        if options['since']:
+            spans = spans.filter(day__gte=options['since'])
+        if options['until']:
+            spans = spans.filter(day__lte=options['until'])
+        if options['bucket']:
+            spans = spans.filter(bucket__in=BucketTree.get().descendants(options['bucket']))
+        stream = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            count = transfer.write(transfer.export_rows(spans), stream, options['format'])
+        finally:
+            if options['output']:
+                stream.close()
+        self.stderr.write('%s time spans exported' % count)
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import transfer
+
+
+class Command(BaseCommand):
+    help = 'Bulk import time spans from CSV or NDJSON, see core.transfer for the columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file, - for stdin')
+        parser.add_argument(
+            '--format', choices=transfer.FORMATS, help='guessed from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--create-buckets', action='store_true', help='unknown titles become new buckets')
+        parser.add_argument(
+            '--skip-invalid', action='store_true',
+            help='import what is valid and list the rest, instead of importing nothing')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        stream = sys.stdin if path == '-' else open(path, newline='')
+        try:
+            imported, errors = transfer.import_spans(
+                transfer.read(stream, format), options['batch_size'],
+                options['create_buckets'], options['skip_invalid'],
+            )
+        except transfer.InvalidRows as e:
+            raise CommandError('nothing imported\n%s' % e)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        for number, error in errors:
+            self.stderr.write('skipped line %s: %s' % (number, error))
+        self.stdout.write('%s time spans imported' % imported)
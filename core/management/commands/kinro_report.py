@@ -0,0 +1,108 @@
+"""
+Monthly reports for many clients at once, one process per client and month:
+
+    ./manage.py kinro_report --from 2018-01 --to 2018-03 --clients all --jobs 4
+"""
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from core import reporting
+from core.models import Bucket
+
+
+def parse_month(value):
+    try:
+        year, month = value.split('-')
+        return int(year), int(month)
+    except ValueError:
+        raise CommandError('%r is not YYYY-MM' % value)
+
+
+def init_worker():
+    """Every worker gets its own connection, read only."""
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA query_only = ON')
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SET default_transaction_read_only = ON')
+
+
+def client_month(job):
+    client_id, year, month = job
+    return reporting.report(*reporting.month_range(year, month), root_id=client_id)
+
+
+class Command(BaseCommand):
+    help = 'Reports per client and month, computed in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='first', required=True, help='YYYY-MM')
+        parser.add_argument('--to', dest='last', help='YYYY-MM, defaults to --from')
+        parser.add_argument(
+            '--clients', default='all', help='"all" or comma separated client bucket titles')
+        parser.add_argument('--jobs', type=int, default=1, help='worker processes')
+        parser.add_argument('--format', choices=('text', 'csv', 'json'), default='text')
+        parser.add_argument(
+            '--compare-serial', action='store_true',
+            help='also run it in this process and print both timings to stderr')
+
+    def handle(self, *args, **options):
+        first = parse_month(options['first'])
+        last = parse_month(options['last'] or options['first'])
+        clients = Bucket.objects.filter(type=Bucket.CLIENTS).order_by('title')
+        if options['clients'] != 'all':
+            clients = clients.filter(title__in=options['clients'].split(','))
+        clients = list(clients)
+        if not clients:
+            raise CommandError('no such clients')
+        jobs = [
+            (client.id, year, month)
+            for year, month in reporting.months(first, last)
+            for client in clients
+        ]
+
+        titles = {client.id: client.title for client in clients}
+
+        started = time.time()
+        results = self.run(jobs, options['jobs'])
+        elapsed = time.time() - started
+        if options['compare_serial']:
+            started = time.time()
+            serial_results = self.run(jobs, 1)
+            serial = time.time() - started
+            differ = [
+                '%04d-%02d %s' % (year, month, titles[client_id])
+                for (client_id, year, month), rows, serial_rows
+                in zip(jobs, results, serial_results)
+                if rows != serial_rows
+            ]
+            if differ:
+                raise CommandError('serial results differ: %s' % ', '.join(differ))
+            sys.stderr.write('%s jobs, serial %.2fs, %s workers %.2fs, speedup %.1fx\n' % (
+                len(jobs), serial, options['jobs'], elapsed, serial / elapsed))
+
+        formatter = getattr(reporting, 'as_%s' % options['format'])
+        # map() keeps the order of jobs, whichever worker finishes first
+        for (client_id, year, month), rows in zip(jobs, results):
+            if not rows:
+                continue
+            if options['format'] == 'text':
+                self.stdout.write('=== %04d-%02d %s' % (year, month, titles[client_id]))
+            self.stdout.write(formatter(rows))
+
+    def run(self, jobs, workers):
+        if workers <= 1:
+            return [client_month(job) for job in jobs]
+        # forked workers must not share the parent's connection
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+            return list(pool.map(client_month, jobs, chunksize=max(1, len(jobs) // workers // 4)))
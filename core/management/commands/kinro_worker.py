@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = 'Bring derived data up to date with writes, for KINRO_JOBS = "worker", see StaleDay.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2, help='seconds between polls')
+        parser.add_argument('--once', action='store_true', help='catch up and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            count = jobs.catch_up()
+            if count and options['verbosity'] > 1:
+                self.stdout.write('%s marks caught up' % count)
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from core.models import BucketDayTotal, DayFocus
+
+
+class Command(BaseCommand):
+    help = 'Fill the daily bucket totals and focus tables from time spans, all or a range of days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=parse_date, help='YYYY-MM-DD')
+        parser.add_argument('--until', type=parse_date, help='YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        BucketDayTotal.rebuild(options['since'], options['until'])
+        DayFocus.rebuild(options['since'], options['until'])
+        self.stdout.write('%s daily totals, %s days of focus' % (
+            BucketDayTotal.objects.count(), DayFocus.objects.count()))
@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import backup
+from core.management.commands.backup import database_path
+
+
+class Command(BaseCommand):
+    help = 'Replace the database with a snapshot made by ./manage.py backup, after checking it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('snapshot')
+        parser.add_argument('--noinput', action='store_false', dest='interactive')
+
+    def handle(self, *args, **options):
+        target = database_path()
+        if options['interactive'] and input(
+            'Everything in %s will be replaced with %s, a snapshot of the current state is '
+            'taken first. Type "yes" to continue: ' % (target, options['snapshot'])
+        ) != 'yes':
+            raise CommandError('cancelled')
+        try:
+            counts = backup.check(options['snapshot'])
+            current, _ = backup.snapshot(target, os.path.dirname(options['snapshot']))
+            connections.close_all()
+            backup.copy(options['snapshot'], target)
+        except backup.BackupError as e:
+            raise CommandError(e)
+        self.stdout.write('the previous state is in %s' % current)
+        self.stdout.write('restored %s, %s rows' % (options['snapshot'], sum(counts.values())))
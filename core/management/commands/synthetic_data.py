@@ -0,0 +1,23 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from core import synthetic
+from core.models import DayCache
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with made up buckets, targets and time spans, see core.synthetic.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=float, default=1)
+        parser.add_argument('--since', type=parse_date, default=date(2015, 1, 5))
+        parser.add_argument('--clients', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        count = synthetic.generate(
+            int(options['years'] * 365), options['since'], options['clients'], options['seed'])
+        DayCache.recalculate_all()
+        self.stdout.write('%s time spans' % count)
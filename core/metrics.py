@@ -0,0 +1,95 @@
+"""
+Opt-in timings, kept in process memory and served as Prometheus text on /metrics.
+
+Nothing is recorded unless `enabled` is set, MetricsMiddleware sets it when settings.KINRO_METRICS
+is on. No Django in here, core.algorithms uses it too.
+
+Every process counts for itself, scrape each one or run one process.
+"""
+import threading
+from functools import wraps
+from time import perf_counter
+
+enabled = False
+
+SECONDS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERIES = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Cumulative buckets per label value, like prometheus_client does it."""
+
+    def __init__(self, name, help_text, label, buckets=SECONDS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self.lock:
+            series = self.series.setdefault(label_value, [[0] * len(self.buckets), 0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.help_text),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self.lock:
+            for label_value, (counts, total, count) in sorted(self.series.items()):
+                label = '%s="%s"' % (self.label, escape(label_value))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append('%s_bucket{%s,le="%s"} %s' % (
+                        self.name, label, bound, bucket_count))
+                lines.append('%s_bucket{%s,le="+Inf"} %s' % (self.name, label, count))
+                lines.append('%s_sum{%s} %s' % (self.name, label, total))
+                lines.append('%s_count{%s} %s' % (self.name, label, count))
+        return '\n'.join(lines)
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+request_seconds = Histogram(
+    'kinro_request_seconds', 'Wall time of a request.', 'view')
+request_queries = Histogram(
+    'kinro_request_queries', 'SQL queries per request.', 'view', QUERIES)
+request_sql_seconds = Histogram(
+    'kinro_request_sql_seconds', 'Time spent in SQL per request.', 'view')
+function_seconds = Histogram(
+    'kinro_function_seconds', 'Wall time of hot functions.', 'function')
+
+HISTOGRAMS = (request_seconds, request_queries, request_sql_seconds, function_seconds)
+
+
+def timed(name):
+    """Decorator, observe the wall time of every call in `function_seconds`, when enabled."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                function_seconds.observe(name, perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def exposition():
+    return '\n'.join(histogram.exposition() for histogram in HISTOGRAMS) + '\n'
+
+
+def reset():
+    for histogram in HISTOGRAMS:
+        with histogram.lock:
+            histogram.series.clear()
@@ -0,0 +1,93 @@
+import cProfile
+import os
+import tempfile
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from core import metrics
+
+
+class QueryTimer:
+    """connection.execute_wrapper, counts queries and the time spent on them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Per view wall time, SQL query count and SQL time, see core.metrics. Streamed responses
+    are timed until the response object is returned, not until the last chunk is sent.
+
+    Async under ASGI, a sync middleware would put every request through Django's one sync
+    thread. The views in core.pool threads are counted and profiled there, see pool.respond;
+    under ASGI the SQL of other sync views and middleware, sessions and auth, is not counted.
+
+    Off unless settings.KINRO_METRICS. When on, a request with an `X-Profile` header is also run
+    under cProfile, the stats go to settings.KINRO_PROFILE_DIR (temp dir by default) and the file
+    name comes back in the `X-Profile-File` response header. Open it with
+    `python -m pstats <file>` or snakeviz.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'KINRO_METRICS', False):
+            raise MiddlewareNotUsed
+        metrics.enabled = True
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryTimer()
+        # views in core.pool threads query on their own connections, respond() wraps those
+        request.query_timer = queries
+        profile = cProfile.Profile() if 'HTTP_X_PROFILE' in request.META else None
+        started = perf_counter()
+        with connection.execute_wrapper(queries):
+            if profile:
+                response = profile.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        return self.observe(request, response, queries, profile, perf_counter() - started)
+
+    async def __acall__(self, request):
+        queries = QueryTimer()
+        request.query_timer = queries
+        profile = None
+        if 'HTTP_X_PROFILE' in request.META:
+            # the event loop has nothing worth profiling, respond() runs the view under it
+            profile = request.view_profile = cProfile.Profile()
+        started = perf_counter()
+        response = await self.get_response(request)
+        return self.observe(request, response, queries, profile, perf_counter() - started)
+
+    def observe(self, request, response, queries, profile, elapsed):
+        match = request.resolver_match
+        view = (match.url_name or match.func.__name__) if match else 'unmatched'
+        metrics.request_seconds.observe(view, elapsed)
+        metrics.request_queries.observe(view, queries.count)
+        metrics.request_sql_seconds.observe(view, queries.seconds)
+        if profile:
+            directory = getattr(settings, 'KINRO_PROFILE_DIR', None) or tempfile.gettempdir()
+            fd, path = tempfile.mkstemp(suffix='.prof', prefix='kinro-%s-' % view, dir=directory)
+            os.close(fd)
+            profile.dump_stats(path)
+            response['X-Profile-File'] = path
+        return response
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_make_url_title_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='daycache',
+            name='previous',
+        ),
+    ]
@@ -0,0 +1,107 @@
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# core.const.FOCUS_FACTOR at the time of writing
+FOCUS_FACTOR = 'ff'
+
+
+def json_to_columns(apps, schema_editor):
+    Bucket = apps.get_model('core', 'Bucket')
+    DayCache = apps.get_model('core', 'DayCache')
+    DayCacheEntry = apps.get_model('core', 'DayCacheEntry')
+    bucket_ids = set(Bucket.objects.values_list('id', flat=True))
+    seen = set()
+    entries = []
+    for day in DayCache.objects.order_by('-id'):
+        if day.date in seen:
+            # date becomes unique, keep the newest
+            day.delete()
+            continue
+        seen.add(day.date)
+        data = json.loads(day.data_json)
+        day.focus_factor = data.pop(FOCUS_FACTOR, 0)
+        day.save(update_fields=['focus_factor'])
+        for bucket_id, entry in data.items():
+            if int(bucket_id) not in bucket_ids:
+                continue
+            entries.append(DayCacheEntry(
+                date=day.date,
+                bucket_id=int(bucket_id),
+                display=entry['display'],
+                local=entry.get('local', False),
+                done=entry['done'],
+                done_cumulative=entry['done_cumulative'],
+                planned=entry.get('planned'),
+                planned_cumulative=entry['planned_cumulative'],
+            ))
+    DayCacheEntry.objects.bulk_create(entries)
+
+
+def columns_to_json(apps, schema_editor):
+    DayCache = apps.get_model('core', 'DayCache')
+    DayCacheEntry = apps.get_model('core', 'DayCacheEntry')
+    for day in DayCache.objects.all():
+        data = {FOCUS_FACTOR: day.focus_factor}
+        for entry in DayCacheEntry.objects.filter(date=day.date).select_related('bucket'):
+            data[entry.bucket_id] = {
+                'display': entry.display,
+                'color': entry.bucket.color,
+                'title': entry.bucket.title,
+                'done': entry.done,
+                'done_cumulative': entry.done_cumulative,
+                'planned_cumulative': entry.planned_cumulative,
+            }
+            if entry.local:
+                data[entry.bucket_id].update(planned=entry.planned, local=True)
+        day.data_json = json.dumps(data)
+        day.save(update_fields=['data_json'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_remove_daycache_previous'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('display', models.BooleanField(default=True)),
+                ('local', models.BooleanField(default=False)),
+                ('done', models.FloatField(default=0)),
+                ('done_cumulative', models.FloatField(default=0)),
+                ('planned', models.PositiveIntegerField(null=True)),
+                ('planned_cumulative', models.PositiveIntegerField(default=0)),
+                ('bucket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Bucket')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='daycacheentry',
+            unique_together=set([('date', 'bucket')]),
+        ),
+        migrations.AddField(
+            model_name='daycache',
+            name='focus_factor',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='daycache',
+            name='data_json',
+            field=models.TextField(default='{}'),
+        ),
+        migrations.RunPython(json_to_columns, columns_to_json),
+        migrations.RemoveField(
+            model_name='daycache',
+            name='data_json',
+        ),
+        migrations.AlterField(
+            model_name='daycache',
+            name='date',
+            field=models.DateField(unique=True),
+        ),
+    ]
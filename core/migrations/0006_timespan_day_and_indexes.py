@@ -0,0 +1,36 @@
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def fill_day(apps, schema_editor):
+    TimeSpan = apps.get_model('core', 'TimeSpan')
+    TimeSpan.objects.update(day=TruncDate('start'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_daycache_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timespan',
+            name='day',
+            field=models.DateField(null=True, editable=False),
+        ),
+        migrations.RunPython(fill_day, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timespan',
+            name='day',
+            field=models.DateField(db_index=True, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='timespan',
+            index=models.Index(fields=['start', 'end'], name='timespan_start_end'),
+        ),
+        migrations.AddIndex(
+            model_name='timespan',
+            index=models.Index(fields=['bucket', 'start'], name='timespan_bucket_start'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from core.algorithms import grouped_merged_lengths
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def fill_totals(apps, schema_editor):
+    """Same as BucketDayTotal.rebuild, written against the migration state."""
+    Bucket = apps.get_model('core', 'Bucket')
+    TimeSpan = apps.get_model('core', 'TimeSpan')
+    BucketDayTotal = apps.get_model('core', 'BucketDayTotal')
+    parents = dict(Bucket.objects.values_list('id', 'parent_id'))
+    rows = []
+    counts = {}
+    spans = TimeSpan.objects.filter(end__isnull=False).values_list(
+        'bucket_id', 'day', 'start', 'end')
+    for bucket_id, day, start, end in spans.iterator():
+        start, end = (start - EPOCH) // MILLISECOND, (end - EPOCH) // MILLISECOND
+        keys = [('local', bucket_id, day)]
+        ancestor_id = bucket_id
+        while ancestor_id:
+            keys.append(('family', ancestor_id, day))
+            ancestor_id = parents[ancestor_id]
+        for key in keys:
+            rows.append((key, start, end))
+            counts[key] = counts.get(key, 0) + 1
+    merged = grouped_merged_lengths(rows)
+    BucketDayTotal.objects.bulk_create(
+        BucketDayTotal(
+            bucket_id=bucket_id, day=day,
+            merged_seconds=merged.get(('local', bucket_id, day), 0) / 1000,
+            span_count=counts.get(('local', bucket_id, day), 0),
+            family_merged_seconds=merged[(what, bucket_id, day)] / 1000,
+            family_span_count=counts[(what, bucket_id, day)],
+        )
+        for what, bucket_id, day in merged
+        if what == 'family'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_timespan_day_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BucketDayTotal',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('merged_seconds', models.FloatField(default=0)),
+                ('span_count', models.PositiveIntegerField(default=0)),
+                ('family_merged_seconds', models.FloatField(default=0)),
+                ('family_span_count', models.PositiveIntegerField(default=0)),
+                ('bucket', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, to='core.Bucket')),
+            ],
+            options={
+                'unique_together': {('bucket', 'day')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timespan',
+            index=models.Index(
+                condition=models.Q(end__isnull=True), fields=['day'], name='timespan_running'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_bucketdaytotal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleDay',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bucket', models.ForeignKey(
+                    null=True, on_delete=django.db.models.deletion.CASCADE, to='core.Bucket')),
+            ],
+        ),
+    ]
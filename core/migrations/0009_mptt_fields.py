@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # django-mptt 0.11+ no longer indexes these one by one
+
+    dependencies = [
+        ('core', '0008_staleday'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bucket',
+            name='level',
+            field=models.PositiveIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='bucket',
+            name='lft',
+            field=models.PositiveIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='bucket',
+            name='rght',
+            field=models.PositiveIntegerField(editable=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+
+from core.algorithms import focus_lengths
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+# core.models.Bucket.FOCUSED at the time of writing
+FOCUSED = 'focused'
+
+
+def fill_focus(apps, schema_editor):
+    """Same as DayFocus.rebuild, written against the migration state."""
+    TimeSpan = apps.get_model('core', 'TimeSpan')
+    DayFocus = apps.get_model('core', 'DayFocus')
+    spans = TimeSpan.objects.filter(end__isnull=False).order_by('start').values_list(
+        'day', 'start', 'end', 'bucket__type')
+    focus = focus_lengths(
+        (day, (start - EPOCH) // MILLISECOND, (end - EPOCH) // MILLISECOND, type_ == FOCUSED)
+        for day, start, end, type_ in spans.iterator()
+    )
+    DayFocus.objects.bulk_create((
+        DayFocus(day=day, focused_seconds=focused / 1000, total_seconds=total / 1000)
+        for day, (focused, total) in focus.items()
+    ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_mptt_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayFocus',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('focused_seconds', models.FloatField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_focus, migrations.RunPython.noop),
+    ]
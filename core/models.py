@@ -1,18 +1,89 @@
-import json
+import random
+import threading
+from collections import namedtuple
+from datetime import timedelta
 
-from django.db import models
-from django.db.models import CASCADE
+from django.conf import settings
+from django.db import models, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import CASCADE, F, Q, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.utils.timezone import now
 from mptt.fields import TreeForeignKey
 from mptt.models import MPTTModel
+from mptt.signals import node_moved
 
-from core.algorithms import merge_overlapping_spans
+from core import events, jobs, sqlite, summary
+from core.algorithms import focus_lengths, grouped_merged_lengths, merged_length
 from core.const import FOCUS_FACTOR
 from core.fields import ColorField
+from core.metrics import timed
 from core.utils import contrasting_text_color, date_range, random_color, to_human_readable_in_hours
 
+Rollup = namedtuple('Rollup', 'local local_count family family_count')
+Rollup.EMPTY = Rollup(0, 0, 0, 0)
+
+
+class Milliseconds(models.Func):
+    """Datetime as integer milliseconds since epoch, calculated by the database.
+
+    Naive datetimes are taken as they are, like UTC, so durations are wall clock durations, the
+    same as `end - start` of two naive datetimes in python. A span from 1:30 to 3:30 on the night
+    clocks go forward (USE_TZ is off, TIME_ZONE Europe/Warsaw) is two hours long, not one.
+    """
+    template = 'CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400000) AS INTEGER)'
+    output_field = models.BigIntegerField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='ROUND(EXTRACT(EPOCH FROM %(expressions)s) * 1000)::bigint',
+            **extra_context
+        )
+
 
 class TimeSpanQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """save() is skipped here, fill what it would."""
+        objs = list(objs)
+        for obj in objs:
+            obj.day = obj.start.date()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """`day` follows `start`, like in save()."""
+        if 'start' in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.day = obj.start.date()
+            fields = {*fields, 'day'}
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        """`day` follows `start`, values and expressions alike."""
+        if 'start' in kwargs and 'day' not in kwargs:
+            start = kwargs['start']
+            kwargs['day'] = TruncDate(start) if hasattr(start, 'resolve_expression') else (
+                models.DateTimeField().to_python(start).date())
+        return super().update(**kwargs)
+
+    def overlapping(self, start, end):
+        """Spans overlapping `start` to `end`, running ones included, see timespan_start_end."""
+        return self.filter(Q(end__gt=start) | Q(end__isnull=True), start__lt=end)
+
+    def milliseconds(self):
+        """Yield (start, end) as integer milliseconds, ordered by start, running spans end now.
+
+        The conversion is done by the database, no model instances, no datetime objects and no
+        result cache are built in python, so it's cheap on big querysets.
+        """
+        return self.order_by('start').annotate(
+            start_ms=Milliseconds('start'),
+            end_ms=Milliseconds(Coalesce('end', Value(now(), output_field=models.DateTimeField()))),
+        ).values_list('start_ms', 'end_ms').iterator()
+
+    @timed('merged_total')
     def merged_total(self):
         """
         TimeSpans sometimes overlap. Treat overlapping spans as one continuous TimeSpan.
@@ -20,18 +91,107 @@ class TimeSpanQuerySet(models.QuerySet):
 
         return: seconds
         """
-        # AttributeError: 'datetime.datetime' object has no attribute 'timestamp' when python2
-        merged = merge_overlapping_spans(
-            (ts.start.timestamp(), ts.get_end().timestamp()) for ts in self)
-        return sum(b - a for a, b in merged)
+        return merged_length(self.milliseconds(), presorted=True) / 1000
+
+    def milliseconds_by(self, *keys):
+        """Like `milliseconds` but rows are prefixed with `keys`, unordered. `date` is the span's
+        `day`."""
+        qs = self.annotate(date=F('day')) if 'date' in keys else self
+        return qs.order_by().annotate(
+            start_ms=Milliseconds('start'),
+            end_ms=Milliseconds(Coalesce('end', Value(now(), output_field=models.DateTimeField()))),
+        ).values_list(*keys, 'start_ms', 'end_ms').iterator()
+
+    def merged_totals_by(self, key='bucket_id'):
+        """`merged_total` for many groups in one query, like:
+        merged_totals_by('bucket_id') -> {bucket_id: seconds}
+        merged_totals_by(('bucket_id', 'date')) -> {(bucket_id, date): seconds}
+        """
+        keys = (key,) if isinstance(key, str) else tuple(key)
+        totals = grouped_merged_lengths(
+            (row[0] if len(keys) == 1 else row[:-2], row[-2], row[-1])
+            for row in self.milliseconds_by(*keys)
+        )
+        return {key: ms / 1000 for key, ms in totals.items()}
+
+    def family_totals(self, tree):
+        """Everything Insight needs to know about these spans, from one query.
+
+        tree: BucketTree
+        return: (
+            {(bucket_id, date): seconds}, where a bucket's total includes its descendants' spans,
+            {date: focus factor},
+        )
+        """
+        rows = []
+        for bucket_id, date, start, end in self.milliseconds_by('bucket_id', 'date'):
+            for ancestor_id in tree.ancestors(bucket_id):
+                rows.append(((ancestor_id, date), start, end))
+            # all spans of the day and focused spans of the day, see focus_factor
+            rows.append(((None, date), start, end))
+            if tree[bucket_id].type == Bucket.FOCUSED:
+                rows.append(((Bucket.FOCUSED, date), start, end))
+        merged = grouped_merged_lengths(rows)
+        family = {
+            key: ms / 1000 for key, ms in merged.items() if key[0] not in (None, Bucket.FOCUSED)
+        }
+        focus = {
+            date: merged.get((Bucket.FOCUSED, date), 0) / ms
+            for (what, date), ms in merged.items()
+            if what is None and ms
+        }
+        return family, focus
+
+    def rollup(self, tree, by_day=False):
+        """Per bucket totals of these spans, from one query.
+
+        tree: BucketTree
+        by_day: per bucket and day instead
+        return: {bucket_id: Rollup} or {(bucket_id, date): Rollup}, family_* include
+            descendants' spans
+        """
+        rows = []
+        counts = {}
+        keys = ('bucket_id', 'date') if by_day else ('bucket_id', )
+        for row in self.milliseconds_by(*keys):
+            bucket_id, start, end = row[0], row[-2], row[-1]
+            day = row[1:-2]
+            rows.append((('local', bucket_id) + day, start, end))
+            counts[('local', bucket_id) + day] = counts.get(('local', bucket_id) + day, 0) + 1
+            for ancestor_id in tree.ancestors(bucket_id):
+                key = ('family', ancestor_id) + day
+                rows.append((key, start, end))
+                counts[key] = counts.get(key, 0) + 1
+        merged = grouped_merged_lengths(rows)
+        return {
+            key[1:] if by_day else key[1]: Rollup(
+                merged.get(('local', ) + key[1:], 0) / 1000,
+                counts.get(('local', ) + key[1:], 0),
+                merged[key] / 1000,
+                counts[key],
+            )
+            for key in merged
+            if key[0] == 'family'
+        }
+
+    def focus_by_day(self):
+        """{day: (focused seconds, total seconds)}, merged, from one query and one pass."""
+        rows = self.order_by('start').annotate(
+            start_ms=Milliseconds('start'),
+            end_ms=Milliseconds(Coalesce('end', Value(now(), output_field=models.DateTimeField()))),
+        ).values_list('day', 'start_ms', 'end_ms', 'bucket__type').iterator()
+        return {
+            day: (focused / 1000, total / 1000)
+            for day, (focused, total) in focus_lengths(
+                (day, start, end, type_ == Bucket.FOCUSED) for day, start, end, type_ in rows
+            ).items()
+        }
 
     def focus_factor(self):
-        # The idea is useful but I just need to think how to display it nicely after recent changes
-        # raise DeprecationWarning
-        merged_total = self.merged_total()
-        if not merged_total:
-            return 0
-        return self.filter(bucket__type=Bucket.FOCUSED).merged_total() / merged_total
+        """Focused time over all time, overlaps merged, see DayFocus for a stored daily series."""
+        days = self.focus_by_day().values()
+        total = sum(total for _, total in days)
+        return sum(focused for focused, _ in days) / total if total else 0
 
 
 class TimeSpan(models.Model):
@@ -64,11 +224,20 @@ class TimeSpan(models.Model):
     end = models.DateTimeField(null=True, blank=True)
     bucket = TreeForeignKey('Bucket', on_delete=CASCADE)
     comment = models.TextField(null=True, blank=True)
+    # start.date(), filled on save, so that per day lookups can use an index instead of
+    # calling date() on every row
+    day = models.DateField(db_index=True, editable=False)
 
     objects = TimeSpanQuerySet.as_manager()
 
     class Meta:
         ordering = ('-start',)
+        indexes = [
+            models.Index(fields=['start', 'end'], name='timespan_start_end'),
+            models.Index(fields=['bucket', 'start'], name='timespan_bucket_start'),
+            # a handful of rows at most, see BucketDayTotal.daily
+            models.Index(fields=['day'], name='timespan_running', condition=Q(end__isnull=True)),
+        ]
 
     def __str__(self):
         # FIXME: move to admin.py, it's the only place that uses this
@@ -85,21 +254,46 @@ class TimeSpan(models.Model):
 
     def save(self, *args, **kwargs):
         # FIXME: check if delta does not span over midnight - one day only
-        # sets bucket.last_started
         if self.end and self.start.day != self.end.day:
             raise ValueError(
                 "Working through midnight not allowed"
             )
-        self.bucket.save()
+        self.day = self.start.date()
+        before = TimeSpan.objects.filter(
+            pk=self.pk).values_list('start', 'end').first() if self.pk else None
         super().save(*args, **kwargs)
-        DayCache.recalculate(self.start.date())
+        StaleDay.mark(self.day, self.bucket_id)
+        if before and before[0].date() != self.day:
+            StaleDay.mark(before[0].date())
+        if not before:
+            events.span('start', self.pk)
+        else:
+            events.span('stop' if before[1] is None and self.end else 'edit', self.pk)
+
+    @classmethod
+    def deleting(cls, instance, origin=None, **kwargs):
+        """pre_delete receiver, runs for admin, queryset and cascading deletes too. Django sends
+        pre_delete for every row of a delete() call before any post_delete, the days are
+        collected here and marked once, by `deleted` after the last row."""
+        pending = _deletes.__dict__.setdefault(id(origin), [origin, 0, set(), []])
+        pending[1] += 1
+        pending[2].add(instance.day)
+
+    @classmethod
+    def deleted(cls, instance, origin=None, **kwargs):
+        """post_delete receiver, see `deleting`."""
+        pending = _deletes.__dict__[id(origin)]
+        pending[1] -= 1
+        pending[3].append(instance.pk)
+        if not pending[1]:
+            del _deletes.__dict__[id(origin)]
+            StaleDay.mark_days(pending[2])
+            for pk in pending[3]:
+                events.span('delete', pk)
 
-    def delete(self, using=None, keep_parents=False):
-        # FIXME: won't run if deleted from admin
 
-        ret = super().delete(using, keep_parents)
-        DayCache.recalculate(self.start.date())
-        return ret
+# TimeSpan deletes in progress in this thread, {id(origin): [origin, rows left, days, ids]}
+_deletes = threading.local()
 
 
 class Bucket(MPTTModel):
@@ -136,28 +330,127 @@ class Bucket(MPTTModel):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        retyped = self.pk and Bucket.objects.filter(pk=self.pk).exclude(type=self.type).exists()
+        super().save(*args, **kwargs)
+        if retyped:
+            DayFocus.bucket_retyped(self.pk)
+
     def family_time_spans_q(self):
         """Returns queryset of all timespans in this bucket and its descendant buckets."""
-        # FIXME: do simple query if it's a leaf
-        family_ids = self.get_descendants(include_self=True).values_list('id', flat=True)
+        family_ids = BucketTree.get().descendants(self.id)
+        if len(family_ids) == 1:
+            return TimeSpan.objects.filter(bucket_id=self.id)
         return TimeSpan.objects.filter(bucket__in=family_ids)
 
     def done(self, date):
         """How much time was spent in this bucket on a given date?"""
-        return self.family_time_spans_q().filter(
-            start__date=date
-        ).merged_total()
+        return BucketDayTotal.rollup([self.id], date, date).get(self.id, Rollup.EMPTY).family
 
     @property
     def done_tag(self):
         # date?
-        return to_human_readable_in_hours(self.family_time_spans_q().merged_total())
+        return to_human_readable_in_hours(
+            BucketDayTotal.rollup([self.id]).get(self.id, Rollup.EMPTY).family)
 
     @property
     def text_color(self):
         return contrasting_text_color(self.color)
 
 
+class Version(models.Model):
+    """What the data kept in memory was read from, for caches in every process at once.
+
+    Writes replace the token with a random one, in their transaction, a cache compares the token
+    before it reuses anything. Random rather than counted, a restored backup brings its own
+    tokens and those only match what was cached from that very data.
+    """
+    BUCKETS = 'buckets'
+
+    name = models.CharField(max_length=32, unique=True)
+    token = models.BigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls, name):
+        token = random.getrandbits(63)
+        if not cls.objects.filter(name=name).update(token=token):
+            cls.objects.update_or_create(name=name, defaults={'token': token})
+
+    @classmethod
+    def get(cls, name):
+        """The token, None before the first bump."""
+        return cls.objects.filter(name=name).values_list('token', flat=True).first()
+
+
+class BucketTree:
+    """All buckets at once, walk the tree in memory instead of asking the database.
+
+    `BucketTree.get()` shares one instance per process, checked against Version.BUCKETS first,
+    one query. Saves, deletes and moves bump it, in whichever process they happen. A fresh
+    `BucketTree()` is always read from the database.
+    """
+    _shared = None
+
+    def __init__(self, buckets=None):
+        if buckets is None:
+            buckets = Bucket.objects.all()
+        self.buckets = {bucket.id: bucket for bucket in buckets}
+        self.children = {}
+        for bucket in self.buckets.values():
+            self.children.setdefault(bucket.parent_id, []).append(bucket.id)
+        self._ancestors = {}
+        self._descendants = {}
+
+    @classmethod
+    def get(cls):
+        # version first, buckets saved in between are read anyway and the tree is rebuilt again
+        version = Version.get(Version.BUCKETS)
+        shared = cls._shared
+        if shared is None or shared.version != version:
+            shared = cls()
+            shared.version = version
+            cls._shared = shared
+        return shared
+
+    @classmethod
+    def invalidate(cls, **kwargs):
+        """Signal receiver, hence kwargs."""
+        Version.bump(Version.BUCKETS)
+        cls._shared = None
+        summary.invalidate()
+
+    def __getitem__(self, bucket_id):
+        return self.buckets[bucket_id]
+
+    def ancestors(self, bucket_id):
+        """Ids of the bucket and its ancestors, from the bucket up to the root."""
+        if bucket_id not in self._ancestors:
+            parent_id = self.buckets[bucket_id].parent_id
+            self._ancestors[bucket_id] = (bucket_id, ) + (
+                self.ancestors(parent_id) if parent_id else ())
+        return self._ancestors[bucket_id]
+
+    def descendants(self, bucket_id):
+        """Ids of the bucket and all buckets below it."""
+        if bucket_id not in self._descendants:
+            family = {bucket_id}
+            for child_id in self.children.get(bucket_id, ()):
+                family |= self.descendants(child_id)
+            self._descendants[bucket_id] = frozenset(family)
+        return self._descendants[bucket_id]
+
+    def client(self, bucket_id):
+        """The nearest client bucket, itself included, or None."""
+        for ancestor_id in self.ancestors(bucket_id):
+            if self.buckets[ancestor_id].type == Bucket.CLIENTS:
+                return self.buckets[ancestor_id]
+
+
+post_save.connect(BucketTree.invalidate, sender=Bucket)
+post_delete.connect(BucketTree.invalidate, sender=Bucket)
+node_moved.connect(BucketTree.invalidate, sender=Bucket)
+
+
 class DailyTarget(models.Model):
     """Your ambition for the day. Like:
      - I plan to work for 8 hours.
@@ -175,7 +468,7 @@ class DailyTarget(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        DayCache.recalculate(self.date)
+        StaleDay.mark(self.date)
 
 
 class DayCache(models.Model):
@@ -183,128 +476,594 @@ class DayCache(models.Model):
     totals. These calculations are expensive and change little for the past days. This model stores
     data used by Insight and displayed by Insight front-end.
 
-    cached data is serialized as json, JsonField was not used as the data will never and ought not
-    to be used in lookups.
-
-    WARNING: JSON
+    One row per calculated day, numbers per bucket live in DayCacheEntry, a plain table indexed
+    by date, so reading a range is one scan with no decoding. `read` puts it back together as
+    {date: data}, where data is what `calculate_day` returns:
+        {bucket_id: {'done': ..., 'done_cumulative': ..., ...}, FOCUS_FACTOR: ...}
     """
 
-    date = models.DateField()
-    # FIXME: NOT USED AT ALL
-    previous = models.OneToOneField(
-        'self', null=True, blank=True, related_name='next', on_delete=CASCADE)
-    data_json = models.TextField()
-
-    _data = None
+    date = models.DateField(unique=True)
+    focus_factor = models.FloatField(default=0)
 
-    @property
-    def data(self):
-        return self._data
-
-    @data.setter
-    def data(self, value):
-        self.data_json = json.dumps(value)
-
-    @data.getter
-    def data(self):
-        if not self._data:
-            # JSON does not allow integers as keys but I really like them
-            self._data = {
-                int(k) if k != FOCUS_FACTOR else k: v
-                for k, v
-                in json.loads(self.data_json).items()
+    @classmethod
+    def read(cls, **filters):
+        """{date: data}, ordered by date, for days matching `filters` (date lookups only)."""
+        days = {
+            date: {FOCUS_FACTOR: focus_factor}
+            for date, focus_factor in cls.objects.filter(**filters).order_by('date').values_list(
+                'date', 'focus_factor')
+        }
+        for entry in DayCacheEntry.objects.filter(**filters).order_by('date', 'id').values(
+            'date', 'bucket_id', 'bucket__title', 'bucket__color', 'display', 'local',
+            'done', 'done_cumulative', 'planned', 'planned_cumulative',
+        ):
+            data = {
+                'display': entry['display'],
+                'color': entry['bucket__color'],
+                'title': entry['bucket__title'],
+                'done': entry['done'],
+                'done_cumulative': entry['done_cumulative'],
+                'planned_cumulative': entry['planned_cumulative'],
             }
-        return self._data
+            if entry['local']:
+                data.update(planned=entry['planned'], local=True)
+            days[entry['date']][entry['bucket_id']] = data
+        return days
+
+    @classmethod
+    def read_before(cls, a_date):
+        """Data of the last calculated day before `a_date` or None."""
+        date = cls.objects.filter(date__lt=a_date).aggregate(models.Max('date'))['date__max']
+        return cls.read(date=date)[date] if date else None
+
+    @classmethod
+    def write(cls, days):
+        """Save {date: data}, days must not be there yet."""
+        cls.objects.bulk_create(
+            DayCache(date=date, focus_factor=data[FOCUS_FACTOR]) for date, data in days.items()
+        )
+        DayCacheEntry.objects.bulk_create(
+            DayCacheEntry(date=date, bucket_id=bucket_id, **DayCacheEntry.columns(entry))
+            for date, data in days.items()
+            for bucket_id, entry in data.items()
+            if bucket_id != FOCUS_FACTOR
+        )
 
     @classmethod
     def invalidate(cls, since):
         """Delete from `since` to now. Recalculate and save."""
+        DayCacheEntry.objects.filter(date__gte=since).delete()
         DayCache.objects.filter(date__gte=since).delete()
 
     @classmethod
     def recalculate_all(cls):
-        cls.recalculate(DailyTarget.objects.all().order_by('date').first().date)
+        first_target = DailyTarget.objects.order_by('date').first()
+        if first_target:
+            cls.rebuild(first_target.date)
 
     @classmethod
-    def recalculate(cls, since):
-        # FIXME: hardly readable, clean up
+    def calculate_day(cls, a_date, previous, targets, tree, done, focus):
+        """Data for one day.
+
+        previous: data of the day before or None
+        targets: {bucket_id: DailyTarget} set for `a_date`
+        tree, done, focus: see BucketTree and TimeSpanQuerySet.family_totals
+        """
+        this_day = {}
+        for target in targets.values():
+            bucket = tree[target.bucket_id]
+            done_today = done.get((bucket.id, a_date), 0)
+            if previous and not target.fresh_start and bucket.id in previous:
+                pb = previous[bucket.id]
+                done_cumulative = pb['done_cumulative'] + done_today
+                planned_cumulative = pb['planned_cumulative'] + target.amount
+            else:
+                done_cumulative = done_today
+                planned_cumulative = target.amount
+
+            this_day[bucket.id] = {
+                'display': True,
+                'color': bucket.color,
+                'title': bucket.title,
+                'done': done_today,
+                'done_cumulative': done_cumulative,
+                'planned': target.amount,
+                'planned_cumulative': planned_cumulative,
+                # Concerns this day only
+                # FIXME: batter name or mechanism needed
+                'local': True
+            }
+
+        # Maybe there is work which was not targeted that day but does add to previous
+        # unfinished targets ?
+        # This only makes sense when there are previous targets.
+        if previous:
+            unfinished_targets = set(previous.keys()) - set(this_day.keys())
+
+            for bucket_id in unfinished_targets:
+                # laughable hack
+                if bucket_id == FOCUS_FACTOR:
+                    continue
+                pb = previous[bucket_id]
+                bucket = tree[bucket_id]
+                done_today = done.get((bucket_id, a_date), 0)
+                # Drop tracking targets that were finished.
+                # was_not_finished_yesterday = pb['done_cumulative'] < pb['planned_cumulative']
+                # was_not_finished_today = done_cumulative < planned_cumulative
+                # Yes, carry on the log for the future use
+                this_day[bucket_id] = {
+                    # But only display it if work was done that day.
+                    # THINK: In the future I might want to call it "verbosity".
+                    'display': bool(done_today),
+                    'color': bucket.color,
+                    'title': bucket.title,
+                    'done': done_today,
+                    'done_cumulative': done_today + pb['done_cumulative'],
+                    'planned_cumulative': pb['planned_cumulative'],
+                }
+        if this_day:
+            this_day[FOCUS_FACTOR] = focus.get(a_date, 0)
+        return this_day
+
+    @classmethod
+    def targets_index(cls, since, until=None):
+        """{date: {bucket_id: DailyTarget}}"""
+        targets = DailyTarget.objects.filter(date__gte=since)
+        if until:
+            targets = targets.filter(date__lte=until)
+        index = {}
+        for dt in targets:
+            index.setdefault(dt.date, {})[dt.bucket_id] = dt
+        return index
+
+    @classmethod
+    @timed('DayCache.rebuild')
+    @transaction.atomic
+    def rebuild(cls, since, tree=None):
+        """Delete everything from `since` on and calculate it again, up to the latest target or
+        span. A constant number of queries, however long the range is.
+
+        tree: BucketTree, the shared one by default
+        """
+        last_before = cls.objects.filter(date__lt=since).aggregate(
+            models.Max('date'))['date__max']
+        if last_before and last_before < since - timedelta(days=1):
+            # days in between were never calculated, fill the gap
+            since = last_before + timedelta(days=1)
         cls.invalidate(since)
-        previous = cls.objects.order_by('date').last()
-        all_dts = DailyTarget.objects.all().order_by('date')
-        if not all_dts:
+        latest_target = DailyTarget.objects.order_by('date').last()
+        if not latest_target:
             return
-        latest_target = all_dts.last().date
-        last_span = TimeSpan.objects.order_by('start').last().start.date()
-        latest = max(latest_target, last_span)
-        targets_index = {}
-        for dt in DailyTarget.objects.filter(date__gte=since):
-            targets_index.setdefault(dt.date, {})
-            targets_index[dt.date][dt.bucket.id] = dt
+        latest = latest_target.date
+        last_span = TimeSpan.objects.order_by('start').last()
+        if last_span:
+            latest = max(latest, last_span.start.date())
+        targets_index = cls.targets_index(since)
+        tree = tree or BucketTree.get()
+        done, focus = TimeSpan.objects.filter(
+            day__gte=since, day__lte=latest).family_totals(tree)
 
+        previous = cls.read(date=last_before)[last_before] if last_before else None
+        days = {}
         for a_date in date_range(since, latest):
-            this_day = {}
-            if a_date in targets_index:
-                for target in targets_index[a_date].values():
-                    bucket = target.bucket
-                    done = bucket.done(a_date)
-                    # if previous:
-                    #     for i, j in previous.data.items():
-                    #         print('previous.data', i, j)
-                    if previous and not target.fresh_start and bucket.id in previous.data:
-                        pb = previous.data[bucket.id]
-                        done_cumulative = pb['done_cumulative'] + done
-                        planned_cumulative = pb['planned_cumulative'] + target.amount
-                    else:
-                        done_cumulative = done
-                        planned_cumulative = target.amount
-
-                    this_day[bucket.id] = {
-                        'display': True,
-                        'color': bucket.color,
-                        'title': bucket.title,
-                        'done': done,
-                        'done_cumulative': done_cumulative,
-                        'planned': target.amount,
-                        'planned_cumulative': planned_cumulative,
-                        # Concerns this day only
-                        # FIXME: batter name or mechanism needed
-                        'local': True
-                    }
-
-            # Maybe there is work which was not targeted that day but does add to previous
-            # unfinished targets ?
-            # This only makes sense when there are previous targets.
-            if previous:
-                unfinished_targets = set(previous.data.keys()) - set(this_day.keys())
-
-                for bucket_id in unfinished_targets:
-                    # laughable hack
-                    if bucket_id == FOCUS_FACTOR:
-                        continue
-                    pb = previous.data[bucket_id]
-                    bucket = Bucket.objects.get(id=bucket_id)
-                    done_today = bucket.done(a_date)
-                    done_cumulative = done_today + pb['done_cumulative']
-                    planned_cumulative = pb['planned_cumulative']
-                    # Drop tracking targets that were finished.
-                    # was_not_finished_yesterday = pb['done_cumulative'] < pb['planned_cumulative']
-                    # was_not_finished_today = done_cumulative < planned_cumulative
-                    worked_on_it_today = bool(done_today)
-                    if True:
-                        # Yes, carry on the log for the future use
-                        this_day[bucket_id] = {
-                            # But only display it if work was done that day.
-                            # THINK: In the future I might want to call it "verbosity".
-                            'display': worked_on_it_today,
-                            'color': bucket.color,
-                            'title': bucket.title,
-                            'done': done_today,
-                            'done_cumulative': done_cumulative,
-                            'planned_cumulative': planned_cumulative,
-                        }
+            this_day = cls.calculate_day(
+                a_date, previous, targets_index.get(a_date, {}), tree, done, focus)
             if this_day:
-                this_day[FOCUS_FACTOR] = TimeSpan.objects.filter(start__date=a_date).focus_factor()
-                dc = DayCache(date=a_date, previous=previous)
-                dc.data = this_day
-                previous = dc
-                dc.save()
+                days[a_date] = previous = this_day
+        cls.write(days)
+
+    @classmethod
+    def live(cls, a_date):
+        """Data for `a_date` calculated from spans as they are now, nothing is saved. Meant for
+        today, where running spans make any cached value stale a second later."""
+        previous = cls.read_before(a_date)
+        targets = cls.targets_index(a_date, a_date).get(a_date, {})
+        tree = BucketTree.get()
+        done, focus = TimeSpan.objects.filter(day=a_date).family_totals(tree)
+        return cls.calculate_day(a_date, previous, targets, tree, done, focus)
+
+    @classmethod
+    def insight(cls, since, until):
+        """{'YYYY-MM-DD': data} as the dashboard shows it, past days cached, today live."""
+        today = now().date()
+        days = {
+            str(day): data
+            for day, data in cls.read(date__gte=since, date__lte=until).items()
+            if day != today
+        }
+        if since <= today <= until:
+            live = cls.live(today)
+            if live:
+                days[str(today)] = live
+        return days
+
+    @classmethod
+    @timed('DayCache.recalculate')
+    @transaction.atomic
+    def recalculate(cls, since, tree=None):
+        """Recalculate day `since` and carry the change forward.
+
+        The following days depend on this one only through `done_cumulative` and
+        `planned_cumulative`, so those are shifted by the difference, in place, until a bucket
+        makes a fresh start or there's no difference left to carry. Anything that changes the
+        shape of the following days, like a bucket appearing or disappearing, falls back to
+        `rebuild`.
+
+        tree: BucketTree, the shared one by default
+        """
+        entries = {entry.bucket_id: entry for entry in DayCacheEntry.objects.filter(date=since)}
+        if not entries:
+            return cls.rebuild(since, tree)
+        previous = cls.read_before(since)
+        targets = cls.targets_index(since, since).get(since, {})
+        tree = tree or BucketTree.get()
+        done, focus = TimeSpan.objects.filter(day=since).family_totals(tree)
+        this_day = cls.calculate_day(since, previous, targets, tree, done, focus)
+        if this_day.keys() - {FOCUS_FACTOR} != entries.keys():
+            return cls.rebuild(since, tree)
+
+        deltas = {}
+        for bucket_id, entry in entries.items():
+            new = DayCacheEntry.columns(this_day[bucket_id])
+            delta = (
+                new['done_cumulative'] - entry.done_cumulative,
+                new['planned_cumulative'] - entry.planned_cumulative,
+            )
+            if any(delta):
+                deltas[bucket_id] = delta
+            for column, value in new.items():
+                setattr(entry, column, value)
+        DayCacheEntry.objects.bulk_update(entries.values(), DayCacheEntry.COLUMNS)
+        cls.objects.filter(date=since).update(focus_factor=this_day[FOCUS_FACTOR])
+
+        # Every following day shifts by the same difference, up to the next fresh start.
+        fresh_starts = dict(DailyTarget.objects.filter(
+            date__gt=since, bucket__in=list(deltas), fresh_start=True,
+        ).values('bucket_id').annotate(first=models.Min('date')).values_list(
+            'bucket_id', 'first')) if deltas else {}
+        for bucket_id, (done, planned) in deltas.items():
+            following = DayCacheEntry.objects.filter(bucket_id=bucket_id, date__gt=since)
+            if bucket_id in fresh_starts:
+                following = following.filter(date__lt=fresh_starts[bucket_id])
+            following.update(
+                done_cumulative=models.F('done_cumulative') + done,
+                planned_cumulative=models.F('planned_cumulative') + planned,
+            )
+
+
+class DayCacheEntry(models.Model):
+    """One bucket of one DayCache day, see DayCache."""
+    COLUMNS = (
+        'display', 'local', 'done', 'done_cumulative', 'planned', 'planned_cumulative')
+
+    date = models.DateField(db_index=True)
+    bucket = models.ForeignKey('Bucket', on_delete=CASCADE)
+    display = models.BooleanField(default=True)
+    # targeted this very day, see DayCache.calculate_day
+    local = models.BooleanField(default=False)
+    done = models.FloatField(default=0)
+    done_cumulative = models.FloatField(default=0)
+    planned = models.PositiveIntegerField(null=True)
+    planned_cumulative = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'bucket')
+
+    @classmethod
+    def columns(cls, data):
+        """Column values from one bucket's data as made by DayCache.calculate_day."""
+        return {
+            'display': data['display'],
+            'local': data.get('local', False),
+            'done': data['done'],
+            'done_cumulative': data['done_cumulative'],
+            'planned': data.get('planned'),
+            'planned_cumulative': data['planned_cumulative'],
+        }
+
+
+class BucketDayTotal(models.Model):
+    """Merged time per bucket and day, so that totals over any range are a SUM over an indexed
+    table instead of a merge of raw spans. Maintained on every TimeSpan save and delete and
+    whenever a bucket moves in the tree, `./manage.py rebuild_rollups` fills it from scratch.
+
+    Closed spans only, a running span's end changes every second. `daily` merges days with a
+    running span live instead.
+    """
+    bucket = models.ForeignKey('Bucket', on_delete=CASCADE)
+    day = models.DateField(db_index=True)
+    merged_seconds = models.FloatField(default=0)
+    span_count = models.PositiveIntegerField(default=0)
+    # the bucket and its descendants
+    family_merged_seconds = models.FloatField(default=0)
+    family_span_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('bucket', 'day')
+
+    @classmethod
+    def from_rollup(cls, rollup):
+        """Unsaved rows from {(bucket_id, day): Rollup}."""
+        return [
+            cls(bucket_id=bucket_id, day=day, merged_seconds=r.local, span_count=r.local_count,
+                family_merged_seconds=r.family, family_span_count=r.family_count)
+            for (bucket_id, day), r in rollup.items()
+        ]
+
+    @classmethod
+    @timed('BucketDayTotal.refresh')
+    @transaction.atomic
+    def refresh(cls, *days, tree=None):
+        """Calculate these days again, from their closed spans.
+
+        tree: BucketTree, the shared one by default
+        """
+        days = sorted(set(days))
+        tree = tree or BucketTree.get()
+        # below SQLite's limit of query parameters
+        for i in range(0, len(days), 500):
+            chunk = days[i:i + 500]
+            rollup = TimeSpan.objects.filter(day__in=chunk, end__isnull=False).rollup(
+                tree, by_day=True)
+            cls.objects.filter(day__in=chunk).delete()
+            cls.objects.bulk_create(cls.from_rollup(rollup))
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, since=None, until=None, tree=None, chunk=timedelta(days=31)):
+        """Calculate everything, or the range, again. A month of spans in memory at a time."""
+        stored = cls.objects.all()
+        spans = TimeSpan.objects.filter(end__isnull=False)
+        if since:
+            stored, spans = stored.filter(day__gte=since), spans.filter(day__gte=since)
+        if until:
+            stored, spans = stored.filter(day__lte=until), spans.filter(day__lte=until)
+        stored.delete()
+        first_last = spans.aggregate(first=models.Min('day'), last=models.Max('day'))
+        tree = tree or BucketTree.get()
+        since = first_last['first']
+        while since and since <= first_last['last']:
+            until = since + chunk
+            cls.objects.bulk_create(cls.from_rollup(spans.filter(
+                day__gte=since, day__lt=until).rollup(tree, by_day=True)))
+            since = until
+
+    @classmethod
+    def bucket_moved(cls, instance, **kwargs):
+        """Signal receiver, ancestors' family totals change with the subtree's days.
+
+        Bucket.save sends it before the new parent is written, hence `instance` over the database.
+        """
+        buckets = {bucket.id: bucket for bucket in Bucket.objects.all()}
+        buckets[instance.id] = instance
+        tree = BucketTree(buckets.values())
+        days = TimeSpan.objects.filter(
+            bucket__in=tree.descendants(instance.id),
+        ).aggregate(first=models.Min('day'), last=models.Max('day'))
+        if days['first']:
+            cls.rebuild(days['first'], days['last'], tree)
+
+    @classmethod
+    def daily(cls, since=None, until=None, bucket_ids=None, tree=None):
+        """{(bucket_id, day): Rollup} read from the table, days with a running span are merged
+        from the spans.
+
+        bucket_ids: only these buckets, their family totals still include all descendants
+        tree: BucketTree, the shared one by default
+        """
+        stored = cls.objects.all()
+        spans = TimeSpan.objects.all()
+        if since:
+            stored, spans = stored.filter(day__gte=since), spans.filter(day__gte=since)
+        if until:
+            stored, spans = stored.filter(day__lte=until), spans.filter(day__lte=until)
+        tree = tree or BucketTree.get()
+        if bucket_ids is not None:
+            bucket_ids = set(bucket_ids)
+            stored = stored.filter(bucket__in=bucket_ids)
+            spans = spans.filter(bucket__in=set().union(
+                *(tree.descendants(bucket_id) for bucket_id in bucket_ids)))
+        running = set(spans.filter(end__isnull=True).order_by().values_list('day', flat=True))
+        result = {
+            (bucket_id, day): Rollup(*values)
+            for bucket_id, day, *values in stored.exclude(day__in=running).values_list(
+                'bucket_id', 'day',
+                'merged_seconds', 'span_count', 'family_merged_seconds', 'family_span_count',
+            ).iterator()
+        }
+        if running:
+            for key, rollup in spans.filter(day__in=running).rollup(tree, by_day=True).items():
+                if bucket_ids is None or key[0] in bucket_ids:
+                    result[key] = rollup
+        return result
+
+    @classmethod
+    def rollup(cls, bucket_ids=None, since=None, until=None):
+        """{bucket_id: Rollup} over the range, see `daily`. Spans don't cross midnight, so
+        merged days add up to the merged range."""
+        totals = {}
+        for (bucket_id, _), rollup in cls.daily(since, until, bucket_ids).items():
+            total = totals.get(bucket_id, Rollup.EMPTY)
+            totals[bucket_id] = Rollup(*(a + b for a, b in zip(total, rollup)))
+        return totals
+
+
+class DayFocus(models.Model):
+    """Merged focused and total time per day, the focus factor series. Maintained with
+    BucketDayTotal, closed spans only, `series` merges days with a running span live.
+
+    Rolling windows come from prefix sums over the series, nothing is merged again.
+    """
+    WINDOWS = (7, 30, 90)
+
+    day = models.DateField(unique=True)
+    focused_seconds = models.FloatField(default=0)
+    total_seconds = models.FloatField(default=0)
+
+    @classmethod
+    def from_focus(cls, focus):
+        """Unsaved rows from {day: (focused, total)}."""
+        return [
+            cls(day=day, focused_seconds=focused, total_seconds=total)
+            for day, (focused, total) in focus.items()
+        ]
+
+    @classmethod
+    @transaction.atomic
+    def refresh(cls, *days):
+        """Calculate these days again, from their closed spans."""
+        days = sorted(set(days))
+        # below SQLite's limit of query parameters
+        for i in range(0, len(days), 500):
+            chunk = days[i:i + 500]
+            focus = TimeSpan.objects.filter(day__in=chunk, end__isnull=False).focus_by_day()
+            cls.objects.filter(day__in=chunk).delete()
+            cls.objects.bulk_create(cls.from_focus(focus))
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, since=None, until=None):
+        """Calculate everything, or the range, again. Rows are streamed, one pass."""
+        stored = cls.objects.all()
+        spans = TimeSpan.objects.filter(end__isnull=False)
+        if since:
+            stored, spans = stored.filter(day__gte=since), spans.filter(day__gte=since)
+        if until:
+            stored, spans = stored.filter(day__lte=until), spans.filter(day__lte=until)
+        stored.delete()
+        cls.objects.bulk_create(cls.from_focus(spans.focus_by_day()), batch_size=500)
+
+    @classmethod
+    def bucket_retyped(cls, bucket_id):
+        """Its spans count as focused, or stop to, on every day they were logged."""
+        days = TimeSpan.objects.filter(bucket_id=bucket_id).aggregate(
+            first=models.Min('day'), last=models.Max('day'))
+        if days['first']:
+            cls.rebuild(days['first'], days['last'])
+
+    @classmethod
+    def series(cls, since, until):
+        """{day: (focused seconds, total seconds)}, days without spans are left out."""
+        spans = TimeSpan.objects.filter(day__gte=since, day__lte=until)
+        running = set(spans.filter(end__isnull=True).order_by().values_list('day', flat=True))
+        result = {
+            day: (focused, total)
+            for day, focused, total in cls.objects.filter(
+                day__gte=since, day__lte=until).exclude(day__in=running).values_list(
+                'day', 'focused_seconds', 'total_seconds')
+        }
+        if running:
+            result.update(spans.filter(day__in=running).focus_by_day())
+        return result
+
+    @classmethod
+    def rolling(cls, since, until, windows=WINDOWS):
+        """Every day from `since` to `until` with its focus factor and rolling ones:
+            [{'day', 'focused', 'total', 'focus_factor', 'rolling': {window: focus factor}}]
+
+        A window's focus factor is its focused time over its total time, a short day weighs
+        less than a long one. None where there is no time at all.
+        """
+        first = since - timedelta(days=max(windows) - 1)
+        series = cls.series(first, until)
+        days = date_range(first, until)
+        focused_sums = [0]
+        total_sums = [0]
+        for day in days:
+            focused, total = series.get(day, (0, 0))
+            focused_sums.append(focused_sums[-1] + focused)
+            total_sums.append(total_sums[-1] + total)
+
+        def ratio(end, window):
+            start = max(end - window, 0)
+            total = total_sums[end] - total_sums[start]
+            return (focused_sums[end] - focused_sums[start]) / total if total else None
+
+        return [
+            {
+                'day': day,
+                'focused': focused_sums[i + 1] - focused_sums[i],
+                'total': total_sums[i + 1] - total_sums[i],
+                'focus_factor': ratio(i + 1, 1),
+                'rolling': {window: ratio(i + 1, window) for window in windows},
+            }
+            for i, day in enumerate(days)
+            if day >= since
+        ]
+
+
+class StaleDay(models.Model):
+    """Spans or targets of `day` changed, derived data (daily totals, DayCache, last_started)
+    is not up to date yet. Written by saves and deletes, consumed by `catch_up`.
+
+    settings.KINRO_JOBS decides when:
+        'sync'    right away, before save() returns, nothing is written here
+        'thread'  a thread in this process, soon after the transaction commits, see core.jobs
+        'worker'  ./manage.py kinro_worker, possibly in another process
+    """
+    day = models.DateField()
+    # the bucket a span was saved to, for last_started
+    bucket = models.ForeignKey('Bucket', null=True, on_delete=CASCADE)
+    created = models.DateTimeField(default=now)
+
+    @classmethod
+    def mark(cls, day, bucket_id=None):
+        cls.mark_days([day], bucket_id)
+
+    @classmethod
+    def mark_days(cls, days, bucket_id=None):
+        """One mark per distinct day, one summary version per month."""
+        days = sorted(set(days))
+        for month in sorted({day.replace(day=1) for day in days}):
+            summary.invalidate(month)
+        mode = getattr(settings, 'KINRO_JOBS', 'sync')
+        if mode == 'sync':
+            return cls.update([(day, bucket_id, now()) for day in days])
+        cls.objects.bulk_create([cls(day=day, bucket_id=bucket_id) for day in days])
+        if mode == 'thread':
+            transaction.on_commit(jobs.wake)
+
+    @classmethod
+    def catch_up(cls):
+        """Update everything marked so far, in one go. Returns how many marks there were.
+
+        The marks are deleted only after the update, a crash leaves them for the next run.
+        """
+        marks = list(cls.objects.order_by('id').values_list('id', 'day', 'bucket_id', 'created'))
+        if not marks:
+            return 0
+        cls.update([mark[1:] for mark in marks])
+        cls.objects.filter(id__lte=marks[-1][0]).delete()
+        return len(marks)
+
+    @classmethod
+    def update(cls, marks):
+        """Coalesced: daily totals once per day, DayCache once, from the earliest day on.
+
+        marks: [(day, bucket_id or None, when)]
+        The buckets are read afresh, a worker keeps running while buckets are added and moved in
+        other processes.
+        """
+        tree = BucketTree()
+        last_started = {}
+        for _, bucket_id, when in marks:
+            if bucket_id:
+                last_started[bucket_id] = max(last_started.get(bucket_id, when), when)
+        for bucket_id, when in last_started.items():
+            # update() so that BucketTree is not invalidated by every span
+            Bucket.objects.filter(pk=bucket_id).update(last_started=when)
+        days = {day for day, _, _ in marks}
+        BucketDayTotal.refresh(*days, tree=tree)
+        DayFocus.refresh(*days)
+        since = min(days)
+        if len(days) == 1:
+            DayCache.recalculate(since, tree)
+        else:
+            DayCache.rebuild(since, tree)
+        events.insight(since)
+
+
+pre_delete.connect(TimeSpan.deleting, sender=TimeSpan)
+post_delete.connect(TimeSpan.deleted, sender=TimeSpan)
+node_moved.connect(BucketDayTotal.bucket_moved, sender=Bucket)
+connection_created.connect(sqlite.configure)
@@ -0,0 +1,134 @@
+"""
+Threads that async views run their database work in, see asgi.py.
+
+Under ASGI Django runs every sync view in one shared thread, a slow /insight holds start/stop up
+behind it, along with every other request. Views decorated here are async and hand the work to:
+
+    reader  settings.KINRO_READ_THREADS threads, dashboards polling queue here, not for the GIL
+    writer  one thread, SQLite takes one writer at a time anyway, writes wait here in order
+            instead of retrying on the database lock
+
+The threads are long lived and so are their connections, with CONN_MAX_AGE > 0 they are reused,
+checked before and after every view like a request's are. Every thread is an executor of its
+own, a streamed response is read chunk by chunk in the thread its view ran in, its cursor stays
+on the connection that opened it. While a thread has streams open, its connections are left as
+they are, other views run in between chunks and would close them under the cursor.
+
+Under WSGI a request has its thread already, the view runs in it, as if it was never decorated.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+_threads = {}
+_busy = {}
+_lock = threading.Lock()
+# streams open in this thread, see `respond` and `finish`
+_local = threading.local()
+# end of a streamed response
+DONE = object()
+
+
+def executor(kind):
+    """The least busy thread of `kind`."""
+    with _lock:
+        if kind not in _threads:
+            size = 1 if kind == 'writer' else getattr(settings, 'KINRO_READ_THREADS', 1)
+            _threads[kind] = [
+                ThreadPoolExecutor(1, thread_name_prefix='kinro-%s-%d' % (kind, i))
+                for i in range(size)
+            ]
+        return min(_threads[kind], key=lambda thread: _busy.get(thread, 0))
+
+
+async def run(thread, function, *args, **kwargs):
+    with _lock:
+        _busy[thread] = _busy.get(thread, 0) + 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            thread, partial(function, *args, **kwargs))
+    finally:
+        with _lock:
+            _busy[thread] -= 1
+
+
+def open_streams():
+    return getattr(_local, 'streams', 0)
+
+
+def respond(view, request, *args, **kwargs):
+    """Run `view` in a pool thread, a streamed response is left for `stream` to read."""
+    if not open_streams():
+        close_old_connections()
+    streaming = False
+    try:
+        with ExitStack() as stack:
+            # MetricsMiddleware's query timer is on another thread's connection
+            if hasattr(request, 'query_timer'):
+                stack.enter_context(connection.execute_wrapper(request.query_timer))
+            # and its profile, under ASGI the middleware only awaits
+            if getattr(request, 'view_profile', None):
+                response = request.view_profile.runcall(view, request, *args, **kwargs)
+            else:
+                response = view(request, *args, **kwargs)
+        streaming = response.streaming and not getattr(response, 'is_async', False)
+        return response
+    finally:
+        if streaming:
+            _local.streams = open_streams() + 1
+        elif not open_streams():
+            close_old_connections()
+
+
+def next_chunk(chunks):
+    return next(chunks, DONE)
+
+
+def finish(response):
+    """Close the view's generator, and the thread's connections once no stream reads from them.
+    Not response.close(), its request_finished closes them either way; the ASGI handler calls it
+    later, in its own thread, on its own connections."""
+    _local.streams -= 1
+    for closer in response._resource_closers:
+        closer()
+    if not open_streams():
+        close_old_connections()
+
+
+async def stream(thread, response, chunks):
+    """Chunks of a sync streaming response, one at a time, read in `thread`. ASGI would list()
+    them all in yet another thread, with yet another connection."""
+    try:
+        while True:
+            chunk = await run(thread, next_chunk, chunks)
+            if chunk is DONE:
+                break
+            yield chunk
+    finally:
+        await run(thread, finish, response)
+
+
+def in_pool(kind):
+    def decorator(view):
+        @wraps(view)
+        async def pooled(request, *args, **kwargs):
+            if 'wsgi.version' in request.META:
+                return await sync_to_async(view)(request, *args, **kwargs)
+            thread = executor(kind)
+            response = await run(thread, respond, view, request, *args, **kwargs)
+            if response.streaming and not getattr(response, 'is_async', False):
+                chunks = iter(response.streaming_content)
+                response.streaming_content = stream(thread, response, chunks)
+            return response
+        return pooled
+    return decorator
+
+
+reader = in_pool('reader')
+writer = in_pool('writer')
@@ -1,85 +1,144 @@
 """
-primitive reporing for shell_plus
-- TODO: split into data and formatters
-- TODO: describe
-- TODO: dry
+Billing reports, data first, formatting second.
+
+    rows = report(date(2018, 3, 1), date(2018, 3, 31))
+    print(as_text(rows))
+
+Every bucket with time spans in the range gets a row. Time logged directly on a client bucket is
+the whole work time for that client, buckets with an url are tasks to bill. Whatever client time
+is not covered by tasks (meetings, breaks, faffing around) is overhead, distributed evenly among
+the client's tasks.
 """
-from collections import defaultdict
-from datetime import datetime
+import csv
+import io
+import json
+from calendar import monthrange
+from collections import defaultdict, namedtuple
+from datetime import date, datetime
 
-from core.models import Bucket
+from django.utils.dateparse import parse_date
+
+from core.models import Bucket, BucketDayTotal, BucketTree
 from core.utils import to_human_readable_in_hours as human
 
 
-def report_a_day(day=datetime.today().strftime('%Y-%m-%d'), split_names=('food', )):
-    # softheart (current employer) rules
-    print('-' * 60)
-    data = defaultdict(lambda: defaultdict(int))
-    for bucket in Bucket.objects.filter(timespan__start__date=day).distinct():
-        client = (
-            Bucket.objects.get(id=bucket.id).get_ancestors().filter(type='client').get().title
-            if bucket.type != Bucket.CLIENTS
-            else bucket.title
+class Row(namedtuple('Row', 'client bucket_id title url seconds overhead')):
+    __slots__ = ()
+
+    @property
+    def total(self):
+        return self.seconds + self.overhead
+
+
+def month_range(year, month):
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def months(first, last):
+    """(year, month) from `first` to `last`, both (year, month) too, inclusive."""
+    year, month = first
+    while (year, month) <= tuple(last):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def reports(periods, root_id=None):
+    """{(since, until): [Row]} for many periods, the daily totals are read once.
+
+    root_id: only this bucket and its descendants, usually a client.
+    Spans never cross midnight so merged daily totals add up to merged period totals.
+    """
+    periods = list(periods)
+    if not periods:
+        return {}
+    tree = BucketTree.get()
+    daily = BucketDayTotal.daily(
+        min(since for since, _ in periods),
+        max(until for _, until in periods),
+        tree.descendants(root_id) if root_id else None,
+        tree,
+    )
+    result = {}
+    for since, until in periods:
+        seconds = defaultdict(int)
+        bucket_ids = set()
+        for (bucket_id, day), rollup in daily.items():
+            if since <= day <= until:
+                seconds[bucket_id] += rollup.family
+                if rollup.local_count:
+                    bucket_ids.add(bucket_id)
+        result[(since, until)] = build_rows(tree, seconds, bucket_ids)
+    return result
+
+
+def report(since, until, root_id=None):
+    return reports([(since, until)], root_id)[(since, until)]
+
+
+def build_rows(tree, seconds, bucket_ids):
+    """Rows for `bucket_ids` in tree order, with client overhead spread over tasks.
+
+    seconds: {bucket_id: merged seconds of the bucket and its descendants}
+    """
+    rows = []
+    client_total = defaultdict(int)
+    tasks = defaultdict(list)
+    for bucket in tree.buckets.values():
+        if bucket.id not in bucket_ids:
+            continue
+        client = tree.client(bucket.id)
+        row = Row(
+            client.title if client else '', bucket.id, bucket.title, bucket.url or '',
+            seconds[bucket.id], 0,
         )
-        seconds = bucket.done(day)
-        # if bucket.type == Bucket.CLIENTS:
-        #     data[client]['all'] += seconds
+        rows.append(row)
         if bucket.url:
-            data[client]['task'] += seconds
-            data[client][(bucket.id, bucket.url, bucket.title)] += seconds
-        else:
-            if bucket.type == Bucket.CLIENTS:
-                data[client]['all'] += seconds
-            else:
-                data[client][(bucket.id, 'url not specified', bucket.title)] += seconds
-        hr = human(seconds)
-        print('%4.4s %-6.6s %40.40s : %-60.60s' % (bucket.id, hr, bucket.url, bucket.title))
-    for client, seconds in data.items():
-        non_task = seconds['all'] - seconds['task']
-        print(
-            '%s\r\t %s  -- all(%s) - tasks(%s) = %s ' % (
-                '-' * 60,
-                client,
-                human(seconds['all']),
-                human(seconds['task']),
-                human(non_task)
-            )
-        )
-        only_tasks = {
-            k: v
-            for k, v
-            in seconds.items()
-            if k not in ('all', 'task') and k[1] != 'url not specified'
-        }
-        per_task = non_task / len(only_tasks)
-        print('each got +%s' % human(per_task))
-        for (bucket_id, bucket_url, bucket_title), task_seconds in only_tasks.items():
-            hr = human(task_seconds + per_task)
-            print('%4.4s %-6.6s %40.40s : %-60.60s' % (bucket_id, hr, bucket_url, bucket_title))
+            tasks[row.client].append(row)
+        elif bucket.type == Bucket.CLIENTS:
+            client_total[row.client] += row.seconds
+    overhead = {}
+    for client, client_tasks in tasks.items():
+        non_task = client_total[client] - sum(row.seconds for row in client_tasks)
+        for row in client_tasks:
+            overhead[row.bucket_id] = non_task / len(client_tasks)
+    return [row._replace(overhead=overhead.get(row.bucket_id, 0)) for row in rows]
+
+
+# formatters
+
+def as_text(rows):
+    lines = []
+    for client in sorted({row.client for row in rows}):
+        client_rows = [row for row in rows if row.client == client]
+        lines.append('-' * 60 + ' ' + client)
+        for row in client_rows:
+            lines.append('%4.4s %-6.6s %40.40s : %-60.60s' % (
+                row.bucket_id, human(row.total), row.url, row.title))
+        overhead = sum(row.overhead for row in client_rows)
+        if overhead:
+            lines.append('overhead distributed among tasks: %s' % human(overhead))
+    return '\n'.join(lines)
+
+
+def as_csv(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(Row._fields + ('total', ))
+    for row in rows:
+        writer.writerow(row + (row.total, ))
+    return out.getvalue()
+
+
+def as_json(rows):
+    return json.dumps([dict(row._asdict(), total=row.total) for row in rows])
+
+
+# shell_plus shortcuts
+
+def report_a_day(day=datetime.today().strftime('%Y-%m-%d')):
+    day = parse_date(str(day))
+    print(as_text(report(day, day)))
 
 
 def report_month(year, month):
-    # clean this
-    cache = {}
-    client_generic = defaultdict(int)
-    for bucket in Bucket.objects.filter(
-        timespan__start__date__year=year,
-        timespan__start__date__month=month,
-    ).distinct():
-        seconds = bucket.family_time_spans_q().filter(
-            start__date__year=year,
-            start__date__month=month,
-        ).merged_total()
-        if bucket.type == 'client':
-            client_generic[bucket.title] += seconds
-        if bucket.url:
-            client_title = cache.setdefault(
-                bucket.id, Bucket.objects.get(
-                    id=bucket.id).get_ancestors().filter(type='client').get().title
-            )
-            client_generic[client_title] -= seconds
-        hr = human(seconds)
-        print('%4.4s %-6.6s %40.40s : %-60.60s' % (bucket.id, hr, bucket.url, bucket.title))
-    for client, cumulative in client_generic.items():
-        if cumulative > 0:
-            print(client, human(cumulative))
+    print(as_text(report(*month_range(year, month))))
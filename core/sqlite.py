@@ -0,0 +1,63 @@
+"""
+SQLite tuned for a dashboard that reads all the time while start/stop calls write.
+
+    # local_settings.py
+    KINRO_SQLITE_PRODUCTION = True
+    # optional, on top of PRODUCTION, like {'cache_size': -64000}
+    KINRO_SQLITE_PRAGMAS = {}
+    CONN_MAX_AGE = 600  # in DATABASES['default'], pragmas are set once per connection
+
+- WAL: readers don't block the writer and the writer doesn't block readers.
+- synchronous=NORMAL: with WAL, no fsync per commit, only at checkpoints. A power cut may lose
+  the last commits, never corrupts the database.
+- busy_timeout: a second writer waits instead of failing with "database is locked".
+- transactions start with BEGIN IMMEDIATE: a transaction that reads first and writes later can't
+  be refused the write lock half way through, which busy_timeout can't help with. Django 4.2 has
+  no option for that, `configure` replaces a private method of the backend and refuses to start
+  when it's gone, rather than quietly go back to deferred transactions. Django 5.1+ could use
+  OPTIONS = {'transaction_mode': 'IMMEDIATE'} instead.
+"""
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PRODUCTION = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # negative is KiB, so 32 MB
+    'cache_size': -32000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+# what transaction.atomic() begins with on SQLite, Django 2.0 to 5.x
+BEGIN_HOOK = '_start_transaction_under_autocommit'
+
+
+def pragmas():
+    """Pragmas from settings, empty when off."""
+    if not getattr(settings, 'KINRO_SQLITE_PRODUCTION', False):
+        return {}
+    return dict(PRODUCTION, **getattr(settings, 'KINRO_SQLITE_PRAGMAS', {}))
+
+
+def apply(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+def configure(sender, connection, **kwargs):
+    """connection_created receiver."""
+    if connection.vendor != 'sqlite':
+        return
+    these = pragmas()
+    if not these:
+        return
+    if not callable(getattr(connection, BEGIN_HOOK, None)):
+        raise ImproperlyConfigured(
+            'KINRO_SQLITE_PRODUCTION: Django %s has no %s, transactions would not start with '
+            'BEGIN IMMEDIATE' % (django.get_version(), BEGIN_HOOK))
+    with connection.cursor() as cursor:
+        apply(cursor, these)
+    # Django starts transactions with a plain, deferred, BEGIN
+    setattr(connection, BEGIN_HOOK, lambda: connection.cursor().execute('BEGIN IMMEDIATE'))
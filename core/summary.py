@@ -0,0 +1,137 @@
+"""
+Merged totals per period and group, for long range overviews, served on /api/summary.
+
+    summary(date(2018, 1, 1), date(2018, 12, 31), 'week', 'client')
+
+One query and one merge pass over the range: spans are keyed by (group, period) and overlaps
+within a key are merged, like `merged_total` does. Spans never cross midnight, a span belongs
+to exactly one period. Periods are named by their first day, a week starts on Monday, the first
+and the last period may be cut by the range.
+
+Results are kept in process memory, along with the Version tokens of the months they cover,
+one query checks them before a result is reused. Span writes replace the token of their month,
+see StaleDay.mark, bucket changes the one shared by all, see BucketTree.invalidate, in whichever
+process they happen. Ranges with a running span change every second and are never kept.
+"""
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from core.algorithms import grouped_merged_lengths
+
+PERIODS = {
+    'day': lambda day: day,
+    'week': lambda day: day - timedelta(days=day.weekday()),
+    'month': lambda day: day.replace(day=1),
+    'year': lambda day: day.replace(month=1, day=1),
+}
+GROUPS = ('bucket', 'client', 'type')
+# results kept, least recently used go first
+MAX_ENTRIES = 128
+
+# Version names, everything and a month
+ALL = 'summary'
+MONTH = 'summary.%04d-%02d'
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def summary(since, until, granularity='day', group='bucket'):
+    """{'groups': [{'id', 'title', 'color'}], 'totals': [{'period', 'group', 'seconds'}]}
+
+    group: 'bucket' spans directly on the bucket, 'client' spans under the nearest client
+        bucket, id None for those under none, 'type' focused or client buckets' spans
+    """
+    from core.models import TimeSpan
+    if granularity not in PERIODS or group not in GROUPS:
+        raise ValueError('granularity: %s, group: %s' % ('|'.join(PERIODS), '|'.join(GROUPS)))
+    key = (since, until, granularity, group)
+    # read before the spans, a write in between changes them and the result isn't reused
+    tokens = versions(since, until)
+    with _lock:
+        if key in _cache and _cache[key][0] == tokens:
+            _cache.move_to_end(key)
+            return _cache[key][1]
+    spans = TimeSpan.objects.filter(day__gte=since, day__lte=until)
+    running = spans.filter(end__isnull=True).order_by().exists()
+    result = calculate(spans, PERIODS[granularity], group)
+    if not running:
+        with _lock:
+            _cache[key] = (tokens, result)
+            _cache.move_to_end(key)
+            while len(_cache) > MAX_ENTRIES:
+                _cache.popitem(last=False)
+    return result
+
+
+def months(since, until):
+    """Version names of the months from `since` to `until`."""
+    year, month = since.year, since.month
+    while (year, month) <= (until.year, until.month):
+        yield MONTH % (year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def versions(since, until):
+    from core.models import Version
+    return frozenset(Version.objects.filter(
+        name__in=[ALL, *months(since, until)]).values_list('name', 'token'))
+
+
+def calculate(spans, period, group):
+    from core.models import Bucket, BucketTree
+    tree = BucketTree.get()
+    if group == 'bucket':
+        def group_of(bucket_id):
+            return bucket_id
+    elif group == 'client':
+        def group_of(bucket_id):
+            client = tree.client(bucket_id)
+            return client.id if client else None
+    else:
+        def group_of(bucket_id):
+            return tree[bucket_id].type
+    totals = grouped_merged_lengths(
+        ((group_of(bucket_id), period(day)), start, end)
+        for bucket_id, day, start, end in spans.milliseconds_by('bucket_id', 'date')
+    )
+    group_ids = {group_id for group_id, _ in totals}
+    if group == 'type':
+        groups = [
+            {'id': type_, 'title': title, 'color': None}
+            for type_, title in Bucket.TYPES if type_ in group_ids
+        ]
+    else:
+        # tree order, a client before its tasks
+        groups = [
+            {'id': bucket.id, 'title': bucket.title, 'color': bucket.color}
+            for bucket in tree.buckets.values() if bucket.id in group_ids
+        ]
+        if None in group_ids:
+            groups.append({'id': None, 'title': '', 'color': None})
+    order = {entry['id']: i for i, entry in enumerate(groups)}
+    return {
+        'groups': groups,
+        'totals': [
+            {'period': day, 'group': group_id, 'seconds': totals[group_id, day] / 1000}
+            for group_id, day in sorted(totals, key=lambda key: (key[1], order[key[0]]))
+        ],
+    }
+
+
+def invalidate(since=None, until=None):
+    """Results covering any day from `since` to `until` are out of date, all of them without
+    arguments. In the writing transaction, other processes see it once it commits."""
+    from core.models import Version
+    if since is None:
+        Version.bump(ALL)
+        return
+    for name in months(since, until or since):
+        Version.bump(name)
+
+
+def drop():
+    """Forget what's kept in this process."""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,87 @@
+"""
+Made up but plausible data, for benchmarks and for trying things out on an empty database.
+
+    generate(days=3 * 365)
+
+Every client gets projects, projects get epics, epics get tasks with urls, four levels deep.
+Every working day one client's background span runs from the morning till the evening, focused
+spans on that client's tasks fill it, sometimes overlapping each other by a few minutes, the way
+a forgotten timer does. Each working day targets eight hours on the client, some days also two
+hours on a task, every month starts fresh.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+
+from django.db import transaction
+
+from core.models import Bucket, BucketDayTotal, DailyTarget, DayFocus, TimeSpan
+
+
+def make_tree(clients, rnd):
+    """{client: [task, ...]}"""
+    tasks = {}
+    for c in range(clients):
+        client = Bucket.objects.create(title='client %s' % c, type=Bucket.CLIENTS)
+        tasks[client] = []
+        for p in range(3):
+            project = Bucket.objects.create(title='project %s.%s' % (c, p), parent=client)
+            for e in range(2):
+                epic = Bucket.objects.create(title='epic %s.%s.%s' % (c, p, e), parent=project)
+                for t in range(4):
+                    tasks[client].append(Bucket.objects.create(
+                        title='task %s.%s.%s.%s' % (c, p, e, t), parent=epic,
+                        url='https://tracker.example.com/%s-%s%s%s' % (c, p, e, t),
+                        estimate=rnd.choice((None, 2, 4, 8, 16)),
+                    ))
+    return tasks
+
+
+def working_day(day, client, tasks, rnd):
+    """Spans of one day."""
+    morning = datetime.combine(day, time(8)) + timedelta(minutes=rnd.randint(0, 90))
+    evening = morning + timedelta(hours=8, minutes=rnd.randint(-60, 60))
+    spans = [TimeSpan(start=morning, end=evening, bucket=client, comment='at the office')]
+    start = morning + timedelta(minutes=rnd.randint(0, 20))
+    while True:
+        end = start + timedelta(minutes=rnd.randint(15, 120))
+        if end > evening:
+            break
+        spans.append(TimeSpan(
+            start=start, end=end, bucket=rnd.choice(tasks),
+            comment=rnd.choice((None, 'code review', 'fixed **it**', 'meeting')),
+        ))
+        # one in ten forgets to stop the timer for a few minutes
+        start = end + timedelta(minutes=rnd.randint(-10, -1) if rnd.random() < .1 else
+                                rnd.randint(0, 15))
+    return spans
+
+
+@transaction.atomic
+def generate(days=365, since=date(2015, 1, 5), clients=3, seed=0):
+    """Create buckets, targets and spans for `days` days from `since`.
+
+    bulk_create all the way, DayCache is not built, daily bucket totals are.
+    return: number of time spans in the database
+    """
+    rnd = random.Random(seed)
+    tasks = make_tree(clients, rnd)
+    spans, targets = [], []
+    for i in range(days):
+        day = since + timedelta(days=i)
+        if day.weekday() >= 5:
+            continue
+        client = rnd.choice(list(tasks))
+        spans.extend(working_day(day, client, tasks[client], rnd))
+        targets.append(DailyTarget(
+            date=day, bucket=client, amount=8 * 3600, fresh_start=day.day == 1))
+        if rnd.random() < .3:
+            targets.append(DailyTarget(
+                date=day, bucket=rnd.choice(tasks[client]), amount=2 * 3600))
+        if len(spans) > 10000:
+            TimeSpan.objects.bulk_create(spans)
+            spans = []
+    TimeSpan.objects.bulk_create(spans)
+    DailyTarget.objects.bulk_create(targets)
+    BucketDayTotal.rebuild()
+    DayFocus.rebuild()
+    return TimeSpan.objects.count()
@@ -2,13 +2,49 @@
 I didn't write tests initially, there was no need to.
 I slowly start to need them but mainly for inisight module.
 """
-from datetime import date, datetime
+import asyncio
+import io
+import json
+import os
+import pstats
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
 from pprint import pprint
+from unittest import mock
 
-from django.test import Client, TestCase
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from core.models import Bucket, DailyTarget, DayCache, TimeSpan
+from core import events, jobs, metrics, pool, reporting, sqlite, summary, synthetic, transfer
+from core.middleware import MetricsMiddleware
+from core.models import (
+    Bucket,
+    BucketDayTotal,
+    BucketTree,
+    DailyTarget,
+    DayCache,
+    DayFocus,
+    StaleDay,
+    TimeSpan,
+    Version,
+)
+from core.utils import date_range
+from core.views import admin_span_url
 
 # factories
 
@@ -47,3 +83,1070 @@ class InsightTests(TestCase):
         assert not data['2016-01-02'][id1]['display']
         assert data['2016-01-03'][id1]['done_cumulative'] == 7200
         assert data['2016-01-03'][id1]['display']
+
+
+class MergedTotalsByTests(TestCase):
+    def test_matches_merged_total(self):
+        b1 = Bucket.objects.create(title='one')
+        b2 = Bucket.objects.create(title='two')
+        TimeSpan.objects.bulk_create([
+            ts(1, 10, b1),
+            ts(1, 12, b2),
+            TimeSpan(start=datetime(2016, 1, 1, 10, 30), end=datetime(2016, 1, 1, 12), bucket=b1),
+            ts(2, 10, b2),
+        ])
+        by_bucket = TimeSpan.objects.merged_totals_by('bucket_id')
+        assert by_bucket == {b1.id: 7200, b2.id: 7200}
+        by_both = TimeSpan.objects.merged_totals_by(('bucket_id', 'date'))
+        assert by_both[(b2.id, date(2016, 1, 2))] == 3600
+        for (bucket_id, day), seconds in by_both.items():
+            assert seconds == TimeSpan.objects.filter(
+                bucket_id=bucket_id, day=day).merged_total()
+
+    def test_wall_clock_across_dst(self):
+        """Last Sundays of March and October 2018, Warsaw clocks jump at 2:00 and 3:00."""
+        bucket = Bucket.objects.create(title='night')
+        spans = [
+            TimeSpan(start=datetime(2018, 3, 25, 1, 30), end=datetime(2018, 3, 25, 3, 30)),
+            TimeSpan(start=datetime(2018, 10, 28, 1, 30), end=datetime(2018, 10, 28, 3, 30)),
+        ]
+        for span in spans:
+            span.bucket = bucket
+        TimeSpan.objects.bulk_create(spans)
+        for span in spans:
+            python = (span.end - span.start).total_seconds()
+            assert python == 7200
+            assert TimeSpan.objects.filter(day=span.start.date()).merged_total() == python
+
+
+@override_settings(KINRO_JOBS='sync')
+class DayCacheRecalculateTests(TestCase):
+    def setUp(self):
+        self.b1 = Bucket.objects.create(title='one')
+        self.b2 = Bucket.objects.create(title='two')
+        DailyTarget.objects.create(date=date(2016, 1, 1), bucket=self.b1, amount=7200)
+        DailyTarget.objects.create(date=date(2016, 1, 2), bucket=self.b2, amount=3600)
+        DailyTarget.objects.create(
+            date=date(2016, 1, 4), bucket=self.b1, amount=3600, fresh_start=True)
+        TimeSpan.objects.bulk_create([
+            ts(1, 10, self.b1),
+            ts(2, 10, self.b2),
+            ts(3, 10, self.b1),
+            ts(5, 10, self.b1),
+        ])
+        DayCache.recalculate_all()
+
+    def snapshot(self):
+        return {str(date): data for date, data in DayCache.read().items()}
+
+    def test_incremental_matches_rebuild(self):
+        ids = set(DayCache.objects.values_list('id', flat=True))
+        ts(1, 14, self.b1).save()
+        ts(2, 14, self.b2).save()
+        incremental = self.snapshot()
+        assert set(DayCache.objects.values_list('id', flat=True)) == ids, 'updated in place'
+        assert incremental['2016-01-03'][self.b1.id]['done_cumulative'] == 3 * 3600
+        assert incremental['2016-01-05'][self.b1.id]['done_cumulative'] == 3600
+        DayCache.recalculate_all()
+        assert incremental == self.snapshot()
+
+    def test_new_target_rebuilds(self):
+        DailyTarget.objects.create(date=date(2016, 1, 3), bucket=self.b2, amount=60)
+        incremental = self.snapshot()
+        assert incremental['2016-01-05'][self.b2.id]['planned_cumulative'] == 3660
+        DayCache.recalculate_all()
+        assert incremental == self.snapshot()
+
+    def test_rebuild_queries_do_not_depend_on_range(self):
+        """Only inserts grow, sqlite takes so many rows per statement."""
+        def queries():
+            BucketTree.invalidate()
+            with CaptureQueriesContext(connection) as captured:
+                DayCache.rebuild(date(2016, 1, 1))
+            return len([q for q in captured if not q['sql'].startswith('INSERT')])
+
+        child = Bucket.objects.create(title='child', parent=self.b1)
+        TimeSpan.objects.bulk_create([ts(day, 15, child) for day in range(1, 29)])
+        assert queries() == 11
+        assert DayCache.read(date=date(2016, 1, 3))[date(2016, 1, 3)][self.b1.id]['done'] == 7200
+        TimeSpan.objects.bulk_create([
+            TimeSpan(start=datetime(2016, month, 1, 15), end=datetime(2016, month, 1, 16),
+                     bucket=child)
+            for month in range(2, 13)
+        ])
+        assert queries() == 11
+        assert DayCache.objects.count() == 336
+
+
+class InsightViewTests(TestCase):
+    def test_today_is_live_and_read_only(self):
+        bucket = Bucket.objects.create(title='one')
+        today = datetime.today().date()
+        DailyTarget.objects.create(date=today, bucket=bucket, amount=3600)
+        TimeSpan.objects.create(start=datetime.now() - timedelta(minutes=30), bucket=bucket)
+        url = reverse('insight', kwargs={'start': str(today), 'end': str(today)})
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(url)
+        assert not [q for q in queries if not q['sql'].startswith('SELECT')]
+        assert response.json()[str(today)][str(bucket.id)]['done'] >= 1800
+
+    def test_etag(self):
+        url = reverse('insight', kwargs={'start': '2016-01-01', 'end': '2016-01-03'})
+        c = Client()
+        response = c.get(url)
+        assert response.status_code == 200
+        response = c.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+
+class TimeSpanListTests(TestCase):
+    def test_time_span_list(self):
+        one = Bucket.objects.create(title='one', color='#ffffff')
+        two = Bucket.objects.create(title='two', type=Bucket.CLIENTS)
+        TimeSpan.objects.bulk_create(
+            [ts(day, 10, one) for day in range(1, 8)] + [ts(day, 9, two) for day in range(1, 8)])
+        TimeSpan.objects.filter(start__day=3).update(comment='*hi*')
+        with self.assertNumQueries(2):
+            response = Client().get(
+                reverse('time_spans'), {'start': '2016-01-01', 'end': '2016-01-08'})
+            data = json.loads(b''.join(response.streaming_content))
+        assert len(data) == 14
+        event = [e for e in data if e['title'] == 'one' and e['start'] == '2016-01-03T10:00:00'][0]
+        assert event['comment'] == '<p><em>hi</em></p>'
+        assert event['textColor'] == 'black'
+        assert event['url'] == reverse('admin:core_timespan_change', args=(
+            TimeSpan.objects.get(bucket=one, start__day=3).id, ))
+        assert event['bucket_url'] == reverse('admin:core_bucket_change', args=(one.id, ))
+        assert {e['rendering'] for e in data if e['title'] == 'two'} == {'background'}
+
+    def test_admin_span_url(self):
+        for pk in (1, 10, 100, 1234567):
+            assert admin_span_url() % pk == reverse('admin:core_timespan_change', args=(pk, ))
+
+
+class TimeSpanIndexTests(TestCase):
+    """sqlite only, EXPLAIN QUERY PLAN wording is vendor specific."""
+
+    def test_day_lookup_uses_index(self):
+        before = TimeSpan.objects.filter(start__date=date(2016, 1, 1)).order_by().explain()
+        after = TimeSpan.objects.filter(day=date(2016, 1, 1)).order_by().explain()
+        assert 'SCAN' in before and 'INDEX' not in before
+        assert 'SEARCH' in after and 'USING INDEX' in after
+
+    def test_range_lookup_uses_index(self):
+        # what time_span_list reads
+        after = TimeSpan.objects.overlapping('2016-01-01', '2016-01-08').explain()
+        assert 'USING INDEX timespan_start_end' in after
+        after = TimeSpan.objects.filter(
+            bucket_id=1, start__gte='2016-01-01').order_by().explain()
+        assert 'USING INDEX timespan_bucket_start' in after
+        after = TimeSpan.objects.filter(end__isnull=True).order_by().explain()
+        assert 'USING INDEX timespan_running' in after
+
+    def test_day_is_filled(self):
+        bucket = Bucket.objects.create(title='one')
+        TimeSpan.objects.bulk_create([ts(1, 10, bucket)])
+        ts(2, 10, bucket).save()
+        assert set(TimeSpan.objects.values_list('day', flat=True)) == {
+            date(2016, 1, 1), date(2016, 1, 2)}
+
+    def test_day_follows_start(self):
+        bucket = Bucket.objects.create(title='one')
+        TimeSpan.objects.bulk_create([ts(1, 10, bucket), ts(2, 10, bucket)])
+
+        def days():
+            return sorted(TimeSpan.objects.values_list('day', flat=True))
+
+        TimeSpan.objects.filter(day=date(2016, 1, 1)).update(start=datetime(2016, 1, 3, 9))
+        assert days() == [date(2016, 1, 2), date(2016, 1, 3)]
+        TimeSpan.objects.update(start=F('start') + timedelta(days=1))
+        assert days() == [date(2016, 1, 3), date(2016, 1, 4)]
+        TimeSpan.objects.filter(day=date(2016, 1, 3)).update(start='2016-01-05 09:00:00')
+        assert days() == [date(2016, 1, 4), date(2016, 1, 5)]
+        spans = list(TimeSpan.objects.all())
+        for span in spans:
+            span.start -= timedelta(days=3)
+        TimeSpan.objects.bulk_update(spans, ['start'])
+        assert days() == [date(2016, 1, 1), date(2016, 1, 2)]
+
+
+@override_settings(KINRO_JOBS='sync')
+class BucketDayTotalTests(TestCase):
+    def setUp(self):
+        self.client_bucket = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+        self.task = Bucket.objects.create(title='task', parent=self.client_bucket)
+
+    def stored(self):
+        return {
+            (row.bucket_id, row.day): (
+                row.merged_seconds, row.span_count,
+                row.family_merged_seconds, row.family_span_count)
+            for row in BucketDayTotal.objects.all()
+        }
+
+    def assert_same_as_rebuild(self):
+        incremental = self.stored()
+        BucketDayTotal.rebuild()
+        assert incremental == self.stored()
+
+    def test_maintained_on_write(self):
+        ts(1, 9, self.client_bucket).save()
+        span = ts(1, 9, self.task)
+        span.save()
+        assert self.stored() == {
+            (self.client_bucket.id, date(2016, 1, 1)): (3600, 1, 3600, 2),
+            (self.task.id, date(2016, 1, 1)): (3600, 1, 3600, 1),
+        }
+        span.start, span.end = datetime(2016, 1, 2, 9), datetime(2016, 1, 2, 11)
+        span.save()
+        assert self.stored()[(self.client_bucket.id, date(2016, 1, 1))] == (3600, 1, 3600, 1)
+        assert self.stored()[(self.client_bucket.id, date(2016, 1, 2))] == (0, 0, 7200, 1)
+        self.assert_same_as_rebuild()
+        # like the admin's bulk delete action, no TimeSpan.delete() calls
+        TimeSpan.objects.filter(bucket=self.task).delete()
+        assert self.stored() == {(self.client_bucket.id, date(2016, 1, 1)): (3600, 1, 3600, 1)}
+
+    def test_bucket_move(self):
+        other = Bucket.objects.create(title='other', type=Bucket.CLIENTS)
+        ts(1, 9, self.task).save()
+        self.task.parent = other
+        self.task.save()
+        assert (self.client_bucket.id, date(2016, 1, 1)) not in self.stored()
+        assert self.stored()[(other.id, date(2016, 1, 1))] == (0, 0, 3600, 1)
+        self.assert_same_as_rebuild()
+
+    def test_running_spans_are_merged_live(self):
+        ts(1, 9, self.task).save()
+        TimeSpan(start=datetime(2016, 1, 2, 9), bucket=self.task).save()
+        assert (self.task.id, date(2016, 1, 2)) not in self.stored()
+        assert self.client_bucket.done(date(2016, 1, 1)) == 3600
+        assert self.client_bucket.done(date(2016, 1, 2)) > 3600
+        rollup = BucketDayTotal.rollup([self.client_bucket.id])[self.client_bucket.id]
+        assert rollup.family_count == 2 and rollup.local_count == 0
+
+    def test_rebuild_rollups_command(self):
+        TimeSpan.objects.bulk_create([ts(1, 9, self.task), ts(2, 9, self.task)])
+        out = io.StringIO()
+        call_command('rebuild_rollups', '--since', '2016-01-02', stdout=out)
+        assert set(self.stored()) == {
+            (self.client_bucket.id, date(2016, 1, 2)), (self.task.id, date(2016, 1, 2))}
+        call_command('rebuild_rollups', stdout=out)
+        assert len(self.stored()) == 4
+
+
+@override_settings(KINRO_JOBS='worker')
+class TimerApiTests(TestCase):
+    def setUp(self):
+        self.task = Bucket.objects.create(title='task')
+        self.other = Bucket.objects.create(title='other')
+        self.client_bucket = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+
+    def post(self, action, bucket, at=None):
+        data = {'bucket': bucket.id}
+        if at:
+            data['at'] = at
+        return self.client.post(reverse('timer', args=(action, )), data)
+
+    def test_one_read_one_write(self):
+        # this month's summary version is there since its first span
+        summary.invalidate(date.today())
+        with CaptureQueriesContext(connection) as captured:
+            response = self.post('start', self.task)
+        assert response.status_code == 200, response.content
+        sql = [q['sql'] for q in captured if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        # the span, the summary version and the StaleDay mark, in one transaction
+        assert len(sql) == 4
+        assert sql[0].startswith('SELECT') and sql[1].startswith('INSERT')
+        assert sql[2].startswith('UPDATE "core_version"')
+        # nothing derived until someone catches up
+        assert not BucketDayTotal.objects.exists()
+        assert StaleDay.objects.count() == 1
+
+    def test_toggle_with_client_timestamps(self):
+        assert self.post('toggle', self.task, '2016-01-01T09:00:00').json()['action'] == 'start'
+        # epoch seconds are local time, like everything else here
+        stop_at = datetime(2016, 1, 1, 10).timestamp()
+        assert self.post('toggle', self.task, stop_at).json()['action'] == 'stop'
+        assert TimeSpan.objects.get().end == datetime(2016, 1, 1, 10)
+
+        assert StaleDay.catch_up() == 2
+        assert self.task.done(date(2016, 1, 1)) == 3600
+        assert Bucket.objects.get(pk=self.task.pk).last_started > self.task.last_started
+
+    def test_client_timestamps_out_of_range_or_with_offsets(self):
+        for at in ('1e20', '-1e20', 'inf', 'nan', '2016-13-01T09:00:00'):
+            response = self.post('start', self.task, at)
+            assert response.status_code == 400, at
+        # Warsaw is an hour ahead of UTC in winter
+        assert self.post('start', self.task, '2016-01-01T10:00:00+02:00').status_code == 200
+        assert TimeSpan.objects.get().start == datetime(2016, 1, 1, 9)
+
+    def test_refusals(self):
+        assert self.post('start', self.task, '2016-01-01T09:00:00').status_code == 200
+        assert self.post('start', self.task).status_code == 400
+        # one focused at a time, clients can overlap
+        assert self.post('start', self.other).status_code == 400
+        assert self.post('start', self.client_bucket, '2016-01-01T09:00:00').status_code == 200
+        assert self.post('stop', self.task, '2016-01-01T08:00:00').status_code == 400
+        assert self.post('stop', self.task, '2016-01-02T08:00:00').status_code == 400
+        assert self.post('stop', self.other).status_code == 400
+        assert self.post('stop', self.task, 'yesterday').status_code == 400
+        url = reverse('timer', args=('start', ))
+        assert self.client.post(url, {'bucket': 0}).status_code == 404
+        assert self.client.get(url).status_code == 405
+
+
+@override_settings(KINRO_JOBS='worker')
+class StaleDayTests(TestCase):
+    def setUp(self):
+        self.task = Bucket.objects.create(title='task')
+        for day in (1, 10, 20):
+            DailyTarget.objects.create(date=date(2016, 1, day), bucket=self.task, amount=3600)
+        StaleDay.catch_up()
+
+    def edit(self, n):
+        """Like admin edits, n saves over 14 days."""
+        spans = [ts(i % 14 + 1, 9 + i % 10, self.task) for i in range(n)]
+        for span in spans:
+            span.save()
+        with CaptureQueriesContext(connection) as captured:
+            call_command('kinro_worker', '--once')
+        return len([q for q in captured if not q['sql'].startswith('INSERT')])
+
+    def test_burst_is_one_recompute(self):
+        BucketTree.get()
+        assert self.edit(3) == self.edit(50)
+        assert not StaleDay.objects.exists()
+        incremental = {str(day): data for day, data in DayCache.read().items()}
+        DayCache.recalculate_all()
+        assert incremental == {str(day): data for day, data in DayCache.read().items()}
+        assert BucketDayTotal.rollup([self.task.id])[self.task.id].local_count == 53
+
+    def test_single_day_is_incremental(self):
+        ts(20, 9, self.task).save()
+        with CaptureQueriesContext(connection) as captured:
+            StaleDay.catch_up()
+        # DayCache.recalculate updates in place, no rebuild deletes
+        assert not any('DELETE FROM "core_daycache"' in q['sql'] for q in captured)
+        assert self.task.done(date(2016, 1, 20)) == 3600
+
+    def test_deletes_mark_each_day_once(self):
+        StaleDay.objects.all().delete()
+        other = Bucket.objects.create(title='other')
+        TimeSpan.objects.bulk_create(
+            [ts(day, hour, other) for day in (1, 2) for hour in range(8, 18)]
+            + [ts(day, 9, self.task) for day in (3, 4)])
+        with CaptureQueriesContext(connection) as captured:
+            other.delete()
+        assert sorted(StaleDay.objects.values_list('day', flat=True)) == [
+            date(2016, 1, 1), date(2016, 1, 2)]
+        # the month's summary version, once for twenty spans
+        assert len([q for q in captured if "'summary.2016-01'" in q['sql']]) == 1
+        with override_settings(KINRO_JOBS='sync'), \
+                mock.patch.object(StaleDay, 'update') as update:
+            TimeSpan.objects.all().delete()
+        update.assert_called_once()
+        assert sorted(day for day, _, _ in update.call_args[0][0]) == [
+            date(2016, 1, 3), date(2016, 1, 4)]
+
+    def test_buckets_changed_after_the_tree_was_cached(self):
+        """A worker process doesn't see other processes' bucket signals."""
+        stale = BucketTree.get()
+        with mock.patch.object(BucketTree, 'get', return_value=stale):
+            client = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+            new = Bucket.objects.create(title='new')
+            ts(20, 9, new).save()
+            task = Bucket.objects.get(pk=self.task.pk)
+            task.move_to(client)
+            ts(20, 11, task).save()
+            assert StaleDay.catch_up() == 2
+        rollup = BucketDayTotal.rollup(since=date(2016, 1, 20), until=date(2016, 1, 20))
+        assert rollup[new.id].local == 3600
+        assert rollup[client.id].family == 3600
+        day = DayCache.read(date=date(2016, 1, 20))[date(2016, 1, 20)]
+        assert day[self.task.id]['done'] == 3600
+
+
+@override_settings(KINRO_JOBS='worker')
+class SummaryTests(TestCase):
+    def setUp(self):
+        summary.drop()
+        self.client_bucket = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+        self.task = Bucket.objects.create(title='task', parent=self.client_bucket)
+        self.other = Bucket.objects.create(title='other')
+        TimeSpan.objects.bulk_create([
+            # Monday and Tuesday, the client's span covers the task's
+            TimeSpan(start=datetime(2016, 1, 4, 9), end=datetime(2016, 1, 4, 17),
+                     bucket=self.client_bucket),
+            ts(4, 10, self.task),
+            ts(4, 10, self.other),
+            ts(5, 10, self.task),
+            ts(5, 10, self.task),
+            ts(11, 10, self.task),
+        ])
+
+    def get(self, granularity, group):
+        return summary.summary(date(2016, 1, 4), date(2016, 1, 17), granularity, group)
+
+    def totals(self, data):
+        return {(str(row['period']), row['group']): row['seconds'] for row in data['totals']}
+
+    def test_merged_per_period_and_group(self):
+        week, next_week = '2016-01-04', '2016-01-11'
+        assert self.totals(self.get('week', 'client')) == {
+            (week, self.client_bucket.id): 8 * 3600 + 3600,
+            (week, None): 3600,
+            (next_week, self.client_bucket.id): 3600,
+        }
+        assert self.totals(self.get('week', 'bucket')) == {
+            (week, self.client_bucket.id): 8 * 3600,
+            (week, self.task.id): 2 * 3600,
+            (week, self.other.id): 3600,
+            (next_week, self.task.id): 3600,
+        }
+        assert self.totals(self.get('month', 'type')) == {
+            ('2016-01-01', Bucket.CLIENTS): 8 * 3600,
+            ('2016-01-01', Bucket.FOCUSED): 3 * 3600,
+        }
+        assert [group['title'] for group in self.get('day', 'client')['groups']] == ['client', '']
+
+    def test_cached_until_a_write_in_range(self):
+        self.get('week', 'bucket')
+        # the versions only
+        with self.assertNumQueries(1):
+            self.get('week', 'bucket')
+        TimeSpan(start=datetime(2016, 2, 1, 9), end=datetime(2016, 2, 1, 10),
+                 bucket=self.task).save()
+        with self.assertNumQueries(1):
+            self.get('week', 'bucket')
+        ts(6, 10, self.other).save()
+        assert self.totals(self.get('week', 'bucket'))['2016-01-04', self.other.id] == 2 * 3600
+
+    def test_timer_api_writes(self):
+        """bulk_create and update, no TimeSpan.save, as another process would write them."""
+        self.get('week', 'bucket')
+        url = reverse('timer', args=('toggle', ))
+        for at in ('2016-01-06T09:00:00', '2016-01-06T10:00:00'):
+            assert self.client.post(url, {'bucket': self.other.id, 'at': at}).status_code == 200
+            totals = self.totals(self.get('week', 'bucket'))
+        assert totals['2016-01-04', self.other.id] == 2 * 3600
+        with self.assertNumQueries(1):
+            self.get('week', 'bucket')
+
+    def test_running_spans_are_not_cached(self):
+        TimeSpan.objects.create(start=datetime(2016, 1, 12, 9), bucket=self.other)
+        self.get('year', 'type')
+        # the versions, running, the tree's version, spans
+        with self.assertNumQueries(4):
+            self.get('year', 'type')
+
+    def test_view(self):
+        url = reverse('summary')
+        response = self.client.get(url, {'from': '2016-01-04', 'to': '2016-01-17'})
+        data = response.json()
+        assert (data['granularity'], data['group'], data['from']) == ('day', 'bucket', '2016-01-04')
+        assert len(data['totals']) == 5
+        assert self.client.get(url, {'from': '2016-01-04', 'to': '2016-01-17'},
+                               HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+        for params in ({}, {'from': '2016-01-04', 'to': '2016-01-17', 'group': 'nope'}):
+            assert self.client.get(url, params).status_code == 400
+
+
+@override_settings(KINRO_JOBS='sync')
+class DayFocusTests(TestCase):
+    def setUp(self):
+        self.client_bucket = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+        self.task = Bucket.objects.create(title='task', parent=self.client_bucket)
+        for start, end in ((9, 17), (10, 11)):
+            TimeSpan.objects.create(
+                start=datetime(2016, 1, 4, start), end=datetime(2016, 1, 4, end),
+                bucket=self.client_bucket if end == 17 else self.task)
+        # overlapping focused spans count once
+        TimeSpan.objects.create(
+            start=datetime(2016, 1, 4, 10, 30), end=datetime(2016, 1, 4, 11, 30), bucket=self.task)
+        ts(6, 9, self.task).save()
+
+    def stored(self):
+        return {
+            day: (focused, total) for day, focused, total in
+            DayFocus.objects.values_list('day', 'focused_seconds', 'total_seconds')}
+
+    def test_kept_up_to_date(self):
+        assert self.stored() == {
+            date(2016, 1, 4): (1.5 * 3600, 8 * 3600),
+            date(2016, 1, 6): (3600, 3600),
+        }
+        assert TimeSpan.objects.focus_factor() == (2.5 * 3600) / (9 * 3600)
+        before = self.stored()
+        DayFocus.rebuild()
+        assert self.stored() == before
+        self.client_bucket.type = Bucket.FOCUSED
+        self.client_bucket.save()
+        assert self.stored()[date(2016, 1, 4)] == (8 * 3600, 8 * 3600)
+
+    def test_rolling_from_prefix_sums(self):
+        days = DayFocus.rolling(date(2016, 1, 4), date(2016, 1, 7), windows=(1, 3))
+        assert [day['day'] for day in days] == date_range(date(2016, 1, 4), date(2016, 1, 7))
+        assert [day['focus_factor'] for day in days] == [1.5 / 8, None, 1, None]
+        assert [day['rolling'][3] for day in days] == [1.5 / 8, 1.5 / 8, 2.5 / 9, 1]
+        assert days[2]['rolling'][1] == days[2]['focus_factor']
+
+    def test_running_day_is_live(self):
+        # running spans end now
+        TimeSpan.objects.create(start=datetime(2016, 1, 6, 12), bucket=self.task)
+        assert DayFocus.series(date(2016, 1, 6), date(2016, 1, 6))[date(2016, 1, 6)][1] > 3600
+
+    def test_view(self):
+        url = reverse('focus')
+        data = self.client.get(url, {'from': '2016-01-04', 'to': '2016-01-06'}).json()
+        assert data['windows'] == [7, 30, 90]
+        assert data['days'][0]['rolling']['7'] == 1.5 / 8
+        assert self.client.get(url, {'from': '2016-01-04'}).status_code == 400
+        for params in (
+                {'from': '2016-01-04', 'to': '2016-01-06', 'windows': '7,0'},
+                {'from': '2016-01-04', 'to': '2016-01-06', 'windows': '100000000'},
+                {'from': '2016-01-04', 'to': '2016-01-06', 'windows': '367'},
+                {'from': '2016-01-04', 'to': '2017-01-04'},
+                {'from': '2016-01-06', 'to': '2016-01-04'},
+                {'from': '0001-01-02', 'to': '0001-01-03'}):
+            assert self.client.get(url, params).status_code == 400, params
+        assert self.client.get(
+            url, {'from': '2016-01-01', 'to': '2016-12-31', 'windows': '366'}).status_code == 200
+
+
+@override_settings(KINRO_JOBS='sync')
+class EventsTests(TestCase):
+    """The broadcaster is fed outside of the event loop, like a request thread would."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.task = Bucket.objects.create(title='task')
+
+    def tearDown(self):
+        self.loop.close()
+
+    def subscribe(self, maxsize=events.MAXSIZE):
+        async def subscribe():
+            return events.Subscription(maxsize).__enter__()
+        subscription = self.loop.run_until_complete(subscribe())
+        self.addCleanup(subscription.close)
+        return subscription
+
+    def received(self, subscription):
+        event, data = self.loop.run_until_complete(subscription.get()).split('\n', 2)[:2]
+        return event[len('event: '):], json.loads(data[len('data: '):])
+
+    def test_nothing_built_without_listeners(self):
+        with mock.patch.object(events, 'span_data') as span_data, \
+                self.captureOnCommitCallbacks(execute=True):
+            ts(1, 9, self.task).save()
+        assert not span_data.called
+
+    def test_span_and_insight_deltas(self):
+        subscription = self.subscribe()
+        span = TimeSpan(start=datetime(2016, 1, 1, 9), bucket=self.task)
+        with self.captureOnCommitCallbacks(execute=True):
+            span.save()
+        # in sync mode the insight comes first, from StaleDay.update inside save()
+        assert self.received(subscription) == ('insight', {'since': '2016-01-01', 'days': {}})
+        event, data = self.received(subscription)
+        assert (event, data['action'], data['id']) == ('span', 'start', span.id)
+        assert data['event']['title'] == 'task'
+        span.end = datetime(2016, 1, 1, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            span.save()
+        self.received(subscription)
+        assert self.received(subscription)[1]['action'] == 'stop'
+        span_id = span.id
+        with self.captureOnCommitCallbacks(execute=True):
+            span.delete()
+        self.received(subscription)
+        assert self.received(subscription)[1] == {'action': 'delete', 'id': span_id, 'event': None}
+
+    def test_slow_client_starts_over(self):
+        subscription = self.subscribe(maxsize=2)
+        for i in range(3):
+            events.broadcast('span', {'id': i})
+        assert self.received(subscription) == ('reset', {})
+
+    @override_settings(KINRO_JOBS='worker')
+    def test_timer_api(self):
+        subscription = self.subscribe()
+        url = reverse('timer', args=('toggle', ))
+        for action in ('start', 'stop'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(url, {'bucket': self.task.id})
+            event, data = self.received(subscription)
+            assert (event, data['action']) == ('span', action)
+            assert data['id'] == TimeSpan.objects.get().id
+
+    def test_needs_asgi(self):
+        assert self.client.get(reverse('events')).status_code == 501
+
+    @mock.patch('core.views.LIFETIME', .5)
+    async def test_stream(self):
+        response = await self.async_client.get(reverse('events'))
+        assert response['Content-Type'] == 'text/event-stream'
+        stream = response.streaming_content
+        assert (await stream.__anext__()).startswith(b'retry: ')
+        assert events.listening()
+        events.broadcast('span', {'id': 1})
+        assert await stream.__anext__() == b'event: span\ndata: {"id": 1}\n\n'
+        # ends after a while, the browser reconnects
+        assert [chunk async for chunk in stream] == [b': keepalive\n\n']
+        assert not events.listening()
+
+
+@override_settings(KINRO_JOBS='worker')
+class PoolTests(TransactionTestCase):
+    """Under ASGI reads and writes run in their own threads, the event loop never waits."""
+
+    def setUp(self):
+        self.task = Bucket.objects.create(title='task')
+
+    async def test_reads_and_writes_in_their_threads(self):
+        threads = []
+
+        def spy(method):
+            def called_in(*args):
+                threads.append(threading.current_thread().name)
+                return method(*args)
+            return called_in
+
+        with mock.patch.object(DayCache, 'insight', spy(DayCache.insight)), \
+                mock.patch.object(StaleDay, 'mark', spy(StaleDay.mark)):
+            response = await self.async_client.get(
+                reverse('insight', args=('2016-01-01', '2016-01-07')))
+            assert response.status_code == 200
+            response = await self.async_client.post(
+                reverse('timer', args=('start', )), {'bucket': self.task.id})
+            assert response.status_code == 200, response.content
+        assert [name.split('_')[0] for name in threads] == ['kinro-reader-0', 'kinro-writer-0']
+
+    async def test_streams_are_read_in_the_pool(self):
+        response = await self.async_client.get(
+            reverse('time_spans'), {'start': '2016-01-01', 'end': '2016-01-07'})
+        assert b''.join([chunk async for chunk in response]) == b'[]'
+
+    async def test_streams_are_read_chunk_by_chunk(self):
+        read = []
+
+        closed = []
+
+        def chunks():
+            try:
+                for i in range(3):
+                    read.append(threading.current_thread().name.split('_')[0])
+                    yield str(i)
+            finally:
+                closed.append(threading.current_thread().name.split('_')[0])
+
+        @pool.reader
+        def view(request):
+            return StreamingHttpResponse(chunks())
+
+        request = RequestFactory().get('/')
+        del request.META['wsgi.version']
+        response = await view(request)
+        content = response.streaming_content
+        assert await content.__anext__() == b'0' and len(read) == 1
+        assert [chunk async for chunk in content] == [b'1', b'2']
+        assert read == ['kinro-reader-0'] * 3
+        # a client gone halfway, the generator is closed where it ran
+        response = await view(request)
+        assert await response._iterator.__anext__() == b'0'
+        await response._iterator.aclose()
+        assert closed == ['kinro-reader-0'] * 2
+
+    async def test_reads_between_chunks_keep_the_stream_open(self):
+        start = datetime(2016, 1, 1, 9)
+        await sync_to_async(TimeSpan.objects.bulk_create)([
+            TimeSpan(start=start + timedelta(seconds=i), end=start + timedelta(seconds=i + 1),
+                     bucket=self.task)
+            for i in range(2500)
+        ])
+        # connections really close, as they would on disk, the test database lives on in this one
+        with mock.patch.object(DatabaseWrapper, 'is_in_memory_db', return_value=False):
+            response = await self.async_client.get(
+                reverse('time_spans'), {'start': '2016-01-01', 'end': '2016-01-02'})
+            content = response.streaming_content
+            chunks = [await content.__anext__() for _ in range(3)]
+            # in the stream's thread, between two chunks, the cursor past its first 2000 rows
+            insight = await self.async_client.get(
+                reverse('insight', args=('2016-01-01', '2016-01-07')))
+            assert insight.status_code == 200
+            chunks += [chunk async for chunk in content]
+            # and the other way around, a stream doesn't take away the connection of another
+            first = await self.async_client.get(
+                reverse('time_spans'), {'start': '2016-01-01', 'end': '2016-01-02'})
+            second = await self.async_client.get(
+                reverse('time_spans'), {'start': '2016-01-01', 'end': '2016-01-02'})
+            first, second = first.streaming_content, second.streaming_content
+            rest = [await first.__anext__() for _ in range(3)]
+            assert [chunk async for chunk in second] == chunks
+            rest += [chunk async for chunk in first]
+        assert len(json.loads(b''.join(chunks))) == 2500
+        assert rest == chunks
+
+    @override_settings(KINRO_METRICS=True)
+    async def test_sql_metrics(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.addCleanup(setattr, metrics, 'enabled', False)
+        response = await self.async_client.get(
+            reverse('time_spans'), {'start': '2016-01-01', 'end': '2016-01-07'})
+        assert response.status_code == 200
+        # the running span, the rest is read after the view returns
+        assert metrics.request_queries.series['time_spans'][1] == 1
+        assert metrics.request_sql_seconds.series['time_spans'][1] > 0
+
+    @override_settings(KINRO_METRICS=True)
+    async def test_metrics_middleware_is_async(self):
+        self.addCleanup(metrics.reset)
+        self.addCleanup(setattr, metrics, 'enabled', False)
+
+        async def get_response(request):
+            return HttpResponse()
+
+        assert iscoroutinefunction(MetricsMiddleware(get_response))
+        assert not iscoroutinefunction(MetricsMiddleware(lambda request: HttpResponse()))
+        with tempfile.TemporaryDirectory() as directory, self.settings(KINRO_PROFILE_DIR=directory):
+            response = await self.async_client.get(
+                reverse('insight', args=('2016-01-01', '2016-01-07')), headers={'X-Profile': '1'})
+            assert response.status_code == 200
+            # profiled in the pool thread, where the view ran
+            functions = pstats.Stats(response['X-Profile-File']).stats
+            assert 'insight' in {name for _, _, name in functions}
+
+
+@override_settings(KINRO_JOBS='thread')
+class JobThreadTests(TransactionTestCase):
+    def test_caught_up_after_commit(self):
+        task = Bucket.objects.create(title='task')
+        with mock.patch.object(jobs, 'DELAY', 0):
+            ts(1, 9, task).save()
+            for _ in range(100):
+                if not StaleDay.objects.exists():
+                    break
+                time.sleep(.05)
+        assert not StaleDay.objects.exists()
+        assert task.done(date(2016, 1, 1)) == 3600
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.task = Bucket.objects.create(title='task', url='http://t/1')
+        self.other = Bucket.objects.create(title='other')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def import_csv(self, lines, *args):
+        path = os.path.join(self.directory, 'spans.csv')
+        with open(path, 'w') as f:
+            f.write('start,end,bucket,url,comment\n' + '\n'.join(lines) + '\n')
+        out = io.StringIO()
+        call_command('import_spans', path, *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_round_trip(self):
+        TimeSpan.objects.bulk_create([ts(1, 9, self.task), ts(2, 9, self.other)])
+        TimeSpan.objects.bulk_create([TimeSpan(start=datetime(2016, 1, 3, 9), bucket=self.other)])
+        for format in transfer.FORMATS:
+            path = os.path.join(self.directory, 'spans.' + format)
+            call_command('export_spans', '--format', format, '-o', path, stderr=io.StringIO())
+            before = list(TimeSpan.objects.values_list('start', 'end', 'bucket_id', 'comment'))
+            TimeSpan.objects.all().delete()
+            call_command('import_spans', path, stdout=io.StringIO())
+            assert before == list(
+                TimeSpan.objects.values_list('start', 'end', 'bucket_id', 'comment'))
+
+    def test_buckets_by_url_or_title(self):
+        Bucket.objects.create(title='task', url='http://t/2')
+        self.import_csv([
+            '2016-01-01 09:00,2016-01-01 10:00,task,http://t/2,',
+            '2016-01-01 09:00,2016-01-01 10:00,other,,',
+            '2016-01-01 09:00,2016-01-01 10:00,new,,',
+        ], '--create-buckets')
+        assert sorted(TimeSpan.objects.values_list('bucket__title', 'bucket__url')) == [
+            ('new', None), ('other', None), ('task', 'http://t/2')]
+        assert BucketDayTotal.objects.filter(bucket=self.other).get().span_count == 1
+
+    def test_invalid_rows(self):
+        lines = [
+            '2016-01-01 09:00,2016-01-01 10:00,task,,',
+            '2016-01-01 23:00,2016-01-02 01:00,task,,',
+            '2016-01-01 09:00,2016-01-01 10:00,nope,,',
+        ]
+        with self.assertRaisesRegex(CommandError, 'line 3: Working through midnight'):
+            self.import_csv(lines)
+        assert not TimeSpan.objects.exists()
+        out = self.import_csv(lines, '--skip-invalid')
+        assert 'skipped line 4' in out and '1 time spans imported' in out
+        assert TimeSpan.objects.count() == 1
+
+    def test_invalid_ndjson_lines(self):
+        path = os.path.join(self.directory, 'spans.ndjson')
+        with open(path, 'w') as f:
+            f.write('\n'.join([
+                '{"start": "2016-01-01 09:00", "end": "2016-01-01 10:00", "bucket": "task"}',
+                '{"start": "2016-01-01 11:00", "end": ',
+                '["2016-01-01 11:00"]',
+                '{"start": "2016-01-01T11:00:00+02:00", "end": "2016-01-01T12:00:00+02:00", '
+                '"bucket": "task"}',
+                '{"start": 123, "bucket": "task"}',
+                '{"start": "2016-01-01 11:00", "end": true, "bucket": "task"}',
+                '{"start": "2016-01-01 11:00", "end": null, "bucket": ["task"]}',
+            ]) + '\n')
+        with self.assertRaisesRegex(CommandError, 'line 2: Expecting value'):
+            call_command('import_spans', path, stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('import_spans', path, '--skip-invalid', stdout=out, stderr=out)
+        out = out.getvalue()
+        assert 'line 3: not a JSON object' in out and 'line 4: local time' in out
+        assert 'line 5: start: 123 is not text' in out and 'line 6: end: True' in out
+        assert "line 7: bucket: ['task']" in out
+        assert TimeSpan.objects.count() == 1
+
+    def test_maintenance_once(self):
+        DailyTarget.objects.create(date=date(2016, 1, 1), bucket=self.task, amount=3600)
+
+        def queries(n):
+            TimeSpan.objects.all().delete()
+            BucketTree.get()
+            with CaptureQueriesContext(connection) as captured:
+                self.import_csv(['2016-01-%02d 09:00,2016-01-%02d 10:00,task,,' % (
+                    day % 28 + 1, day % 28 + 1) for day in range(n)])
+            return len([q for q in captured if not q['sql'].startswith('INSERT')])
+
+        assert queries(5) == queries(50)
+        assert DayCache.read(date=date(2016, 1, 1))[date(2016, 1, 1)][self.task.id]['done'] > 0
+
+
+class SyntheticDataTests(TestCase):
+    def test_generate(self):
+        count = synthetic.generate(days=14, since=date(2016, 1, 4))
+        # ten working days
+        assert DailyTarget.objects.filter(bucket__type=Bucket.CLIENTS).count() == 10
+        assert TimeSpan.objects.filter(bucket__type=Bucket.CLIENTS).count() == 10
+        assert count > 30
+        assert Bucket.objects.filter(level=3).exclude(url=None).exists()
+        assert all(start.date() == end.date() for start, end in TimeSpan.objects.values_list(
+            'start', 'end'))
+        assert BucketDayTotal.objects.filter(bucket__type=Bucket.CLIENTS).count() == 10
+
+
+class SqliteProductionTests(TestCase):
+    def test_connection_created(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = DatabaseWrapper(
+                dict(connection.settings_dict, NAME=os.path.join(directory, 'db.sqlite3')))
+            with self.settings(KINRO_SQLITE_PRODUCTION=True,
+                               KINRO_SQLITE_PRAGMAS={'cache_size': -1000}):
+                wrapper.ensure_connection()
+            with wrapper.cursor() as cursor:
+                for pragma, value in (
+                        ('journal_mode', 'wal'), ('synchronous', 1), ('busy_timeout', 5000),
+                        ('cache_size', -1000), ('temp_store', 2)):
+                    assert cursor.execute('PRAGMA %s' % pragma).fetchone()[0] == value
+            # how transaction.atomic() begins
+            with CaptureQueriesContext(wrapper) as captured:
+                wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+            assert captured[0]['sql'] == 'BEGIN IMMEDIATE'
+            wrapper.connection.rollback()
+            wrapper.close()
+
+    def test_no_begin_hook(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = DatabaseWrapper(
+                dict(connection.settings_dict, NAME=os.path.join(directory, 'db.sqlite3')))
+            with self.settings(KINRO_SQLITE_PRODUCTION=True), \
+                    mock.patch.object(sqlite, 'BEGIN_HOOK', '_gone_in_this_django'):
+                with self.assertRaisesRegex(ImproperlyConfigured, 'BEGIN IMMEDIATE'):
+                    wrapper.ensure_connection()
+            wrapper.close()
+
+    def test_off(self):
+        with connection.cursor() as cursor:
+            # FULL, the default
+            assert cursor.execute('PRAGMA synchronous').fetchone()[0] == 2
+
+
+class BucketTreeTests(TestCase):
+    def test_tree(self):
+        client = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+        project = Bucket.objects.create(title='project', parent=client)
+        task = Bucket.objects.create(title='task', parent=project)
+        tree = BucketTree.get()
+        assert tree.descendants(client.id) == {client.id, project.id, task.id}
+        assert tree.ancestors(task.id) == (task.id, project.id, client.id)
+        assert tree.client(task.id) == client
+        assert BucketTree.get() is tree
+        other = Bucket.objects.create(title='other', type=Bucket.CLIENTS)
+        assert BucketTree.get() is not tree
+        task.move_to(other)
+        assert BucketTree.get().client(task.id) == other
+        TimeSpan.objects.bulk_create([ts(1, 10, task), ts(1, 12, project)])
+        # the tree's version and the spans
+        with self.assertNumQueries(2):
+            assert other.family_time_spans_q().merged_total() == 3600
+
+    def test_changes_from_other_processes(self):
+        """Another process saves buckets, the signals fire over there, only the version is seen."""
+        client = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+        task = Bucket.objects.create(title='task')
+        tree = BucketTree.get()
+        Bucket.objects.bulk_create([Bucket(title='other', lft=1, rght=2, tree_id=9, level=0)])
+        other = Bucket.objects.get(title='other')
+        Bucket.objects.filter(pk=task.pk).update(parent=client)
+        assert BucketTree.get() is tree
+        Version.bump(Version.BUCKETS)
+        assert BucketTree.get().ancestors(task.id) == (task.id, client.id)
+        assert BucketTree.get().client(other.id) is None
+
+
+class BucketAdminTests(TestCase):
+    def queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('admin:core_bucket_changelist'))
+        assert response.status_code == 200
+        return response, len(captured)
+
+    def add_family(self, n):
+        root = Bucket.objects.create(title='root %s' % n, type=Bucket.CLIENTS)
+        child = Bucket.objects.create(title='child %s' % n, parent=root, estimate=3600)
+        TimeSpan.objects.bulk_create([ts(1, 10, root), ts(1, 10, child), ts(2, 10, child)])
+        BucketDayTotal.rebuild()
+
+    def test_changelist_queries_stay_flat(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.add_family(0)
+        response, few = self.queries()
+        assert b'2:00 (2)' in response.content
+        assert b'2:00 (3)' in response.content
+        for n in range(1, 10):
+            self.add_family(n)
+        response, many = self.queries()
+        assert few == many
+
+
+@override_settings(KINRO_METRICS=True)
+class MetricsTests(TestCase):
+    def tearDown(self):
+        metrics.enabled = False
+        metrics.reset()
+
+    def test_metrics(self):
+        bucket = Bucket.objects.create(title='one')
+        TimeSpan.objects.bulk_create([ts(1, 10, bucket)])
+        response = self.client.get(
+            reverse('time_spans'), {'start': '2016-01-01', 'end': '2016-01-02'})
+        assert response.status_code == 200
+        body = self.client.get(reverse('metrics')).content.decode()
+        assert 'kinro_request_seconds_count{view="time_spans"} 1' in body
+        assert 'kinro_request_queries_bucket{view="time_spans",le="2"} 1' in body
+        assert 'kinro_request_sql_seconds_sum{view="time_spans"}' in body
+
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(KINRO_PROFILE_DIR=directory):
+            response = self.client.get(reverse('metrics'), HTTP_X_PROFILE='1')
+            path = response['X-Profile-File']
+            assert path.startswith(directory) and pstats.Stats(path).total_calls
+
+    @override_settings(KINRO_METRICS=False)
+    def test_off_by_default(self):
+        assert self.client.get(reverse('metrics')).status_code == 404
+
+
+class ReportingTests(TestCase):
+    def setUp(self):
+        self.client_bucket = Bucket.objects.create(title='client', type=Bucket.CLIENTS)
+        self.task = Bucket.objects.create(title='task', parent=self.client_bucket, url='http://t/1')
+        self.other = Bucket.objects.create(title='other', parent=self.client_bucket)
+        TimeSpan.objects.bulk_create([
+            TimeSpan(start=datetime(2016, 1, 1, 8), end=datetime(2016, 1, 1, 12),
+                     bucket=self.client_bucket),
+            ts(1, 9, self.task),
+            ts(1, 10, self.other),
+            ts(2, 10, self.task),
+            TimeSpan(start=datetime(2016, 2, 1, 8), end=datetime(2016, 2, 1, 12),
+                     bucket=self.client_bucket),
+        ])
+        BucketDayTotal.rebuild()
+
+    def test_report(self):
+        rows = {row.title: row for row in reporting.report(date(2016, 1, 1), date(2016, 1, 1))}
+        assert rows['client'].seconds == 4 * 3600
+        assert rows['task'].seconds == 3600
+        # four client hours, one of them on the task
+        assert rows['task'].overhead == 3 * 3600
+        assert rows['other'].overhead == 0
+        assert 'task' in reporting.as_text(rows.values())
+        assert reporting.as_csv(rows.values()).startswith(
+            'client,bucket_id,title,url,seconds,overhead,total')
+        assert json.loads(reporting.as_json(rows.values()))[0]['client'] == 'client'
+
+    def test_months_from_one_read(self):
+        periods = [reporting.month_range(*m) for m in reporting.months((2016, 1), (2016, 12))]
+        # the tree's version, running days, daily totals, the tree is cached
+        with self.assertNumQueries(3):
+            result = reporting.reports(periods)
+        january = {row.title: row for row in result[periods[0]]}
+        assert january['task'].seconds == 7200
+        # client family time: 4 hours on the 1st, the task hour on the 2nd
+        assert january['task'].overhead == 5 * 3600 - 7200
+        assert [row.title for row in result[periods[1]]] == ['client']
+        assert result[periods[2]] == []
+
+    def test_kinro_report_command(self):
+        other_client = Bucket.objects.create(title='another', type=Bucket.CLIENTS)
+        TimeSpan.objects.bulk_create([ts(3, 9, other_client)])
+        BucketDayTotal.rebuild()
+        out = io.StringIO()
+        call_command(
+            'kinro_report', '--from', '2016-01', '--to', '2016-02', '--format', 'json',
+            stdout=out)
+        # months first, clients by title, empty ones skipped
+        reports = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [[row['title'] for row in rows] for rows in reports] == [
+            ['another'], ['client', 'other', 'task'], ['client']]
+
+    def test_kinro_report_compare_serial(self):
+        from core.management.commands.kinro_report import Command
+        rows = reporting.report(*reporting.month_range(2016, 1))
+        with mock.patch.object(Command, 'run', side_effect=[[rows, []], [rows, rows]]):
+            with self.assertRaisesRegex(CommandError, 'differ: 2016-02 client$'):
+                call_command(
+                    'kinro_report', '--from', '2016-01', '--to', '2016-02', '--jobs', '2',
+                    '--compare-serial', stdout=io.StringIO(), stderr=io.StringIO())
+
+
+class KinroReportProcessesTests(TransactionTestCase):
+    """Worker processes can't see an in-memory database, the command runs in its own process
+    against a copy in a file."""
+
+    def test_jobs(self):
+        synthetic.generate(days=62, since=date(2016, 1, 1), clients=2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+            target = sqlite3.connect(path)
+            connection.ensure_connection()
+            connection.connection.backup(target)
+            target.close()
+            with open(os.path.join(directory, 'copy_settings.py'), 'w') as f:
+                f.write('from settings import *\nDATABASES["default"]["NAME"] = %r\n' % path)
+            process = subprocess.run(
+                [sys.executable, 'manage.py', 'kinro_report', '--from', '2016-01', '--to',
+                 '2016-02', '--format', 'json', '--jobs', '2', '--compare-serial'],
+                capture_output=True, text=True, cwd=settings.BASE_DIR,
+                env=dict(os.environ, DJANGO_SETTINGS_MODULE='copy_settings',
+                         PYTHONPATH=os.pathsep.join([directory, settings.BASE_DIR])))
+        assert process.returncode == 0, process.stderr
+        assert '2 workers' in process.stderr
+        out = io.StringIO()
+        call_command(
+            'kinro_report', '--from', '2016-01', '--to', '2016-02', '--format', 'json',
+            stdout=out)
+        assert process.stdout == out.getvalue()
+        assert len(process.stdout.splitlines()) == 4
@@ -0,0 +1,168 @@
+"""
+Time spans in and out as CSV or NDJSON, a row per span:
+
+    start,end,bucket,url,comment
+    2018-03-01 09:00:00,2018-03-01 10:30:00,task,https://tracker.example.com/1,
+
+`bucket` is a title, `url` wins when both are given, an empty `end` is a running span.
+
+Imports skip TimeSpan.save: rows are checked and bulk inserted in batches, daily totals, DayCache
+and `last_started` are brought up to date once, at the end.
+"""
+import csv
+import json
+
+from django.db import models, transaction
+from django.db.models.functions import Greatest
+from django.utils.dateparse import parse_datetime
+
+from core import summary
+from core.models import Bucket, BucketDayTotal, DayCache, DayFocus, TimeSpan
+
+FIELDS = ('start', 'end', 'bucket', 'url', 'comment')
+FORMATS = ('csv', 'ndjson')
+
+
+class InvalidRows(ValueError):
+    """Carries every bad row, not just the first one."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('\n'.join('line %s: %s' % error for error in errors))
+
+
+def read(stream, format):
+    """Yield (line number, {field: value}), NDJSON lines as they are, `parse` decodes them, so a
+    broken line is reported like any other bad row."""
+    if format == 'csv':
+        # the header is line 1
+        return enumerate(csv.DictReader(stream), 2)
+    return ((number, line) for number, line in enumerate(stream, 1) if line.strip())
+
+
+class BucketMap:
+    """Title and url to bucket id, all buckets read once."""
+
+    def __init__(self, create=False):
+        self.create = create
+        self.by_url = {}
+        self.by_title = {}
+        for bucket_id, title, url in Bucket.objects.values_list('id', 'title', 'url'):
+            if url:
+                self.by_url[url] = bucket_id
+            self.by_title.setdefault(title, []).append(bucket_id)
+
+    def __call__(self, title, url):
+        if url and url in self.by_url:
+            return self.by_url[url]
+        ids = self.by_title.get(title, [])
+        if len(ids) == 1:
+            return ids[0]
+        if ids:
+            raise ValueError('%d buckets titled %r, give an url' % (len(ids), title))
+        if not self.create or not title:
+            raise ValueError('no bucket %r %s' % (title, url or ''))
+        bucket = Bucket.objects.create(title=title, url=url or None)
+        self.by_title[title] = [bucket.id]
+        if url:
+            self.by_url[url] = bucket.id
+        return bucket.id
+
+
+def parse(row, buckets):
+    """TimeSpan from a row, ValueError when TimeSpan.save would refuse it."""
+    if isinstance(row, str):
+        row = json.loads(row)
+        if not isinstance(row, dict):
+            raise ValueError('not a JSON object')
+    for field in FIELDS:
+        if row.get(field) is not None and not isinstance(row[field], str):
+            raise ValueError('%s: %r is not text' % (field, row[field]))
+    start = parse_datetime(row.get('start') or '')
+    end = parse_datetime(row['end']) if row.get('end') else None
+    if not start or (row.get('end') and not end):
+        raise ValueError('start and end must look like 2018-03-01 09:00:00')
+    if start.tzinfo or (end and end.tzinfo):
+        # USE_TZ is off, times are local and naive, the database refuses anything else
+        raise ValueError('local time without a UTC offset please')
+    if end and start.date() != end.date():
+        raise ValueError('Working through midnight not allowed')
+    if end and end < start:
+        raise ValueError('ends before it starts')
+    return TimeSpan(
+        start=start, end=end, bucket_id=buckets(row.get('bucket'), row.get('url')),
+        comment=row.get('comment') or None,
+    )
+
+
+@transaction.atomic
+def import_spans(rows, batch_size=2000, create_buckets=False, skip_invalid=False):
+    """Insert spans from (line number, row) pairs, see `read`. All or nothing, InvalidRows lists
+    what's wrong, unless skip_invalid.
+
+    return: (number of spans imported, [(line number, error)])
+    """
+    buckets = BucketMap(create_buckets)
+    errors = []
+    batch = []
+    imported = 0
+    first_day = last_day = None
+    latest = {}
+    for number, row in rows:
+        try:
+            span = parse(row, buckets)
+        except ValueError as e:
+            errors.append((number, e))
+            continue
+        batch.append(span)
+        first_day = min(first_day or span.start.date(), span.start.date())
+        last_day = max(last_day or span.start.date(), span.start.date())
+        latest[span.bucket_id] = max(latest.get(span.bucket_id, span.start), span.start)
+        if len(batch) == batch_size:
+            if skip_invalid or not errors:
+                TimeSpan.objects.bulk_create(batch)
+            imported += len(batch)
+            batch = []
+    if errors and not skip_invalid:
+        raise InvalidRows(errors)
+    TimeSpan.objects.bulk_create(batch)
+    imported += len(batch)
+
+    if imported:
+        for bucket_id, start in latest.items():
+            Bucket.objects.filter(pk=bucket_id).update(
+                last_started=Greatest(
+                    'last_started', models.Value(start, output_field=models.DateTimeField())))
+        BucketDayTotal.rebuild(first_day, last_day)
+        DayFocus.rebuild(first_day, last_day)
+        summary.invalidate(first_day, last_day)
+        DayCache.rebuild(first_day)
+    return imported, errors
+
+
+def export_rows(queryset):
+    """Yield rows as dicts, streamed from the database."""
+    for start, end, title, url, comment in queryset.order_by('start').values_list(
+        'start', 'end', 'bucket__title', 'bucket__url', 'comment',
+    ).iterator(chunk_size=2000):
+        yield {
+            'start': str(start),
+            'end': str(end) if end else '',
+            'bucket': title,
+            'url': url or '',
+            'comment': comment or '',
+        }
+
+
+def write(rows, stream, format):
+    """Write rows as they come, returns how many."""
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+    else:
+        for count, row in enumerate(rows, 1):
+            stream.write(json.dumps(row) + '\n')
+    return count
@@ -1,21 +1,26 @@
-from django.conf.urls import url
 from django.contrib import admin
+from django.urls import re_path
 
 from core import views
 
 urlpatterns = [
-    url(r'^$', views.dashboard),
+    re_path(r'^$', views.dashboard),
     # dashboard for a given date, the problem is that navigating in frontend does not change the url
     # value dynamically, this is surprising
-    url(r'^(?P<start>[0-9-]+)$', views.dashboard),
-    url(r'^start/(?P<id_>\d+)$', views.start_time_span),
-    url(r'^stop/(?P<id_>\d+)$', views.end_time_span),
+    re_path(r'^(?P<start>[0-9-]+)$', views.dashboard),
+    re_path(r'^start/(?P<id_>\d+)$', views.start_time_span),
+    re_path(r'^stop/(?P<id_>\d+)$', views.end_time_span),
+    re_path(r'^api/timer/(?P<action>start|stop|toggle)$', views.timer, name='timer'),
+    re_path(r'^api/summary$', views.summary_view, name='summary'),
+    re_path(r'^api/focus$', views.focus_view, name='focus'),
 
     # lists
-    url(r'^time_spans/$', views.time_span_list, name='time_spans'),
-    url(r'^insight/(?P<start>[0-9-]+)/(?P<end>[0-9-]+)$', views.insight, name='insight'),
+    re_path(r'^time_spans/$', views.time_span_list, name='time_spans'),
+    re_path(r'^insight/(?P<start>[0-9-]+)/(?P<end>[0-9-]+)$', views.insight, name='insight'),
+    re_path(r'^events$', views.event_stream, name='events'),
 
-    url(r'^admin/', admin.site.urls),
+    re_path(r'^metrics$', views.metrics_view, name='metrics'),
+    re_path(r'^admin/', admin.site.urls),
     # experiments
-    url(r'^tree/$', views.tree, name='tree'),
+    re_path(r'^tree/$', views.tree, name='tree'),
 ]
@@ -1,51 +1,116 @@
+import asyncio
 from datetime import datetime, timedelta
+from functools import lru_cache
+from hashlib import md5
 
 import markdown
 from django.conf import settings
-from django.db.models import Q
-from django.http import HttpResponse, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
-from django.utils.dateparse import parse_date
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_aware, make_naive, now
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
+from core import events, metrics, pool, summary
 from core.const import FOCUS_FACTOR
-from core.models import Bucket, DayCache, TimeSpan
+from core.models import Bucket, DayCache, DayFocus, StaleDay, TimeSpan
 from core.utils import contrasting_text_color
 
+# seconds between keepalive comments on an idle event stream, also the reconnect delay
+KEEPALIVE = 15
+# seconds before an event stream ends and the browser reconnects, Django 4.2 doesn't notice
+# disconnected clients, their subscriptions would live for as long as the process does
+LIFETIME = 300
+# longest range and rolling window /api/focus takes, in days, a window reads as many days back
+FOCUS_MAX_DAYS = 366
+# stands in for a span id in one reverse(), digits no admin URL has anywhere else
+SPAN_ID_PLACEHOLDER = 9876543210
+
+
+@lru_cache(maxsize=4096)
+def render_comment(comment):
+    """Comments rarely change and the calendar asks for the same spans over and over."""
+    return markdown.markdown(comment)
+
+
+def admin_span_url():
+    """'/admin/core/timespan/%d/change/', reverse() per span costs more than the rest of it."""
+    url = reverse('admin:core_timespan_change', args=(SPAN_ID_PLACEHOLDER, ))
+    placeholder = str(SPAN_ID_PLACEHOLDER)
+    if url.count(placeholder) != 1:
+        raise ValueError('span id placeholder found %d times in %s' % (
+            url.count(placeholder), url))
+    return url.replace('%', '%%').replace(placeholder, '%d')
+
 
 def time_span_to_json(queryset, running_id=None):
-    return [
-        {
-            'start': instance.start,
-            'end': instance.get_end(),
-            'title': instance.bucket.title,
-            'color': instance.bucket.color,
-            'textColor': contrasting_text_color(instance.bucket.color),
-            'comment': markdown.markdown(instance.comment or ''),
-            'url': reverse('admin:core_timespan_change', args=(instance.id, )),
-            'bucket_url': reverse('admin:core_bucket_change', args=(instance.bucket.id, )),
-            'rendering': 'background' if instance.bucket.type == Bucket.CLIENTS else '',
-            'className': [
-                'current_event' if instance.id == running_id else '',
-                'small' if (instance.get_end() - instance.start).total_seconds() < 900 else '',
-            ]
-        } for instance in queryset
-    ]
+    """Yields FullCalendar events, buckets come joined in the same query."""
+    span_url = admin_span_url()
+    buckets = {}
+    for instance in queryset.values(
+        'id', 'start', 'end', 'comment',
+        'bucket_id', 'bucket__title', 'bucket__color', 'bucket__type',
+    ).iterator():
+        bucket_id = instance['bucket_id']
+        if bucket_id not in buckets:
+            buckets[bucket_id] = {
+                'title': instance['bucket__title'],
+                'color': instance['bucket__color'],
+                'textColor': contrasting_text_color(instance['bucket__color']),
+                'bucket_url': reverse('admin:core_bucket_change', args=(bucket_id, )),
+                'rendering': 'background' if instance['bucket__type'] == Bucket.CLIENTS else '',
+            }
+        end = instance['end'] or now()
+        yield dict(
+            buckets[bucket_id],
+            id=instance['id'],
+            start=instance['start'],
+            end=end,
+            comment=render_comment(instance['comment']) if instance['comment'] else '',
+            url=span_url % instance['id'],
+            className=[
+                'current_event' if instance['id'] == running_id else '',
+                'small' if (end - instance['start']).total_seconds() < 900 else '',
+            ],
+        )
+
+
+def stream_json_list(items, chunk=100):
+    """Encode a list of dicts bit by bit, never holding all of it in memory."""
+    encoder = DjangoJSONEncoder()
+    yield '['
+    batch = []
+    for i, item in enumerate(items):
+        batch.append(encoder.encode(item))
+        if len(batch) == chunk:
+            yield (',' if i >= chunk else '') + ','.join(batch)
+            batch = []
+    if batch:
+        yield (',' if i >= chunk else '') + ','.join(batch)
+    yield ']'
 
 
+@pool.reader
 def time_span_list(request):
     start = request.GET.get('start')
     end = request.GET.get('end')
     assert start and end, 'missing GET params'
-    # those fitting start-end and those in progress
-    queryset = TimeSpan.objects.filter(
-        Q(start__gte=start, end__lte=end) | Q(start__gte=start, end__isnull=True)
+    queryset = TimeSpan.objects.overlapping(start, end)
+    running_id = TimeSpan.objects.filter(
+        bucket__type=Bucket.FOCUSED, end__isnull=True).values_list('id', flat=True).first()
+    return StreamingHttpResponse(
+        stream_json_list(time_span_to_json(queryset, running_id)),
+        content_type='application/json',
     )
-    running = TimeSpan.objects.filter(bucket__type=Bucket.FOCUSED, end__isnull=True)
-    data = time_span_to_json(queryset, running.get().id if running else None)
-    return JsonResponse(data, safe=False)
 
 
+@pool.reader
 def dashboard(request, start=None):
     running = TimeSpan.objects.filter(end__isnull=True)
     running_focused = running.filter(bucket__type=Bucket.FOCUSED)
@@ -66,12 +131,14 @@ def dashboard(request, start=None):
 
 def toggle(request, title):
     running = TimeSpan.objects.filter(bucket__title=title, end__isnull=True)
+    # the undecorated views, this one is already in a thread
     if running:
-        return end_time_span(request, title)
+        return end_time_span.__wrapped__(request, title)
     else:
-        return start_time_span(request, title)
+        return start_time_span.__wrapped__(request, title)
 
 
+@pool.writer
 def start_time_span(request, id_):
     bucket = Bucket.objects.get(id=id_)
     if TimeSpan.objects.filter(end__isnull=True, bucket__type=Bucket.FOCUSED).count():
@@ -80,6 +147,7 @@ def start_time_span(request, id_):
     return HttpResponse('ok')
 
 
+@pool.writer
 def end_time_span(request, id_):
     # FIXME: call it end_focused_task
     if id_:
@@ -92,16 +160,171 @@ def end_time_span(request, id_):
     return HttpResponse('ok')
 
 
+def parse_at(value):
+    """Client timestamp, ISO 8601 or seconds since epoch, now when not given. Local and naive,
+    like everything else here, an ISO time with a UTC offset is converted."""
+    if not value:
+        return datetime.now()
+    try:
+        return datetime.fromtimestamp(float(value))
+    except (OverflowError, OSError):
+        raise ValueError('at: %r is out of range' % value)
+    except ValueError:
+        at = parse_datetime(value)
+    if not at:
+        raise ValueError('at: %r is neither ISO 8601 nor a timestamp' % value)
+    if is_aware(at):
+        at = make_naive(at)
+    return at
+
+
+@pool.writer
+@csrf_exempt
+@require_POST
+def timer(request, action):
+    """Start, stop or toggle a bucket's timer, fast, for scripts and editor hooks:
+
+        curl -X POST kinro.lvh.me/api/timer/toggle -d bucket=12 [-d at=1520000000]
+
+    `at` is when it happened on the client, events queued while offline keep their order.
+    One read and one write transaction, daily totals, DayCache and last_started are left to
+    StaleDay, see settings.KINRO_JOBS.
+    """
+    try:
+        bucket_id = int(request.POST['bucket'])
+        at = parse_at(request.POST.get('at'))
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'error': 'bucket id and optional at needed, %s' % e}, status=400)
+    running = TimeSpan.objects.filter(end__isnull=True).order_by()
+    with transaction.atomic():
+        state = Bucket.objects.filter(pk=bucket_id).annotate(
+            running_id=Subquery(running.filter(bucket=OuterRef('pk')).values('id')[:1]),
+            running_start=Subquery(running.filter(bucket=OuterRef('pk')).values('start')[:1]),
+            other_focused=Subquery(running.filter(bucket__type=Bucket.FOCUSED).exclude(
+                bucket=OuterRef('pk')).values('id')[:1]),
+        ).values('type', 'running_id', 'running_start', 'other_focused').first()
+        if state is None:
+            return JsonResponse({'error': 'no bucket %s' % bucket_id}, status=404)
+        if action == 'toggle':
+            action = 'stop' if state['running_id'] else 'start'
+        if action == 'start':
+            if state['running_id']:
+                return JsonResponse({'error': 'already running'}, status=400)
+            if state['type'] == Bucket.FOCUSED and state['other_focused']:
+                return JsonResponse(
+                    {'error': "focused task already in progress, can't have two"}, status=400)
+            # bulk_create skips TimeSpan.save and its synchronous maintenance
+            TimeSpan.objects.bulk_create([TimeSpan(start=at, bucket_id=bucket_id)])
+            if events.listening():
+                # older SQLite and Django don't return ids from bulk_create
+                events.span('start', TimeSpan.objects.filter(
+                    bucket_id=bucket_id, end__isnull=True).values_list('id', flat=True).first())
+        else:
+            if not state['running_id']:
+                return JsonResponse({'error': 'not running'}, status=400)
+            if at < state['running_start'] or at.date() != state['running_start'].date():
+                return JsonResponse(
+                    {'error': 'must end after it started, the same day'}, status=400)
+            TimeSpan.objects.filter(pk=state['running_id']).update(end=at)
+            events.span('stop', state['running_id'])
+        StaleDay.mark(at.date(), bucket_id)
+    return JsonResponse({'bucket': bucket_id, 'action': action, 'at': at})
+
+
+@pool.reader
 def insight(request, start, end):
-    # FIXME: dirty hack, recalculate today so that  progress bars show truth
-    # Fix by treating today differently, skip cache
-    DayCache.recalculate(datetime.today().date())
+    """Past days come from DayCache, today is calculated live, running spans keep changing it.
+    Unchanged responses are answered with 304, see ETag."""
+    data = DayCache.insight(parse_date(start), parse_date(end))
+    response = JsonResponse(data=data, safe=False)
+    etag = '"%s"' % md5(response.content).hexdigest()
+    response['ETag'] = etag
+    return get_conditional_response(request, etag=etag, response=response)
 
-    return JsonResponse(data={
-        str(o.date): o.data
-        for o in DayCache.objects.filter(date__gte=parse_date(start), date__lte=parse_date(end))
-    }, safe=False)
+
+async def event_stream(request):
+    """Server-Sent Events for the dashboard, see core.events. Needs an ASGI server:
+
+        uvicorn asgi:application --port 7001
+
+    Under WSGI a stream would tie up a worker forever, the dashboard gets a 501, EventSource
+    gives up and it works as it did before, reload to see changes.
+    """
+    if 'wsgi.version' in request.META:
+        return HttpResponse('live updates need ASGI, see asgi.py', status=501)
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LIFETIME
+        with events.Subscription() as subscription:
+            yield 'retry: %d\n\n' % (KEEPALIVE * 1000)
+            while loop.time() < deadline:
+                try:
+                    yield await asyncio.wait_for(
+                        subscription.get(), min(KEEPALIVE, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    # proxies drop quiet connections, a comment line keeps it open
+                    yield ': keepalive\n\n'
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx would buffer the stream otherwise
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@pool.reader
+def summary_view(request):
+    """Merged totals per period and group, see core.summary:
+
+        /api/summary?from=2018-01-01&to=2018-12-31&granularity=week&group=client
+    """
+    granularity = request.GET.get('granularity', 'day')
+    group = request.GET.get('group', 'bucket')
+    try:
+        since = parse_date(request.GET.get('from', ''))
+        until = parse_date(request.GET.get('to', ''))
+        if not since or not until:
+            raise ValueError('from and to: YYYY-MM-DD')
+        data = summary.summary(since, until, granularity, group)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    response = JsonResponse(dict(
+        data, granularity=granularity, group=group, **{'from': since, 'to': until}))
+    etag = '"%s"' % md5(response.content).hexdigest()
+    response['ETag'] = etag
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+@pool.reader
+def focus_view(request):
+    """Daily focus factor with rolling averages, see DayFocus.rolling:
+
+        /api/focus?from=2018-01-01&to=2018-03-31[&windows=7,30,90]
+    """
+    try:
+        since = parse_date(request.GET.get('from', ''))
+        until = parse_date(request.GET.get('to', ''))
+        if not since or not until:
+            raise ValueError('from and to: YYYY-MM-DD')
+        if not 0 <= (until - since).days < FOCUS_MAX_DAYS:
+            raise ValueError('from to to: up to %d days' % FOCUS_MAX_DAYS)
+        windows = request.GET.get('windows')
+        windows = tuple(int(w) for w in windows.split(',')) if windows else DayFocus.WINDOWS
+        if not all(1 <= window <= FOCUS_MAX_DAYS for window in windows):
+            raise ValueError('windows: 1 to %d days, like 7,30,90' % FOCUS_MAX_DAYS)
+        days = DayFocus.rolling(since, until, windows)
+    except (ValueError, OverflowError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'windows': windows, 'days': days})
 
 
 def tree(request):
     return render(request, 'core/tree.html')
+
+
+def metrics_view(request):
+    """Prometheus text format, see core.metrics."""
+    if not metrics.enabled:
+        raise Http404
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4')
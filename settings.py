@@ -13,6 +13,8 @@ INSTALLED_APPS = [
     'mptt',
 ]
 MIDDLEWARE = [
+    # off unless KINRO_METRICS, first so that it times everything below
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -31,6 +33,7 @@ TEMPLATES = [
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
             ],
         },
     },
@@ -40,10 +43,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # with KINRO_SQLITE_PRODUCTION, keep connections and their pragmas, like 600
+        'CONN_MAX_AGE': 0,
     }
 }
+# WAL, synchronous=NORMAL, busy timeout and friends, see core.sqlite
+KINRO_SQLITE_PRODUCTION = False
+KINRO_SQLITE_PRAGMAS = {}
 
 ROOT_URLCONF = 'core.urls'
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 AUTH_PASSWORD_VALIDATORS = []
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Europe/Warsaw'
@@ -52,6 +61,18 @@ USE_L10N = False
 USE_TZ = False
 STATIC_URL = '/static/'
 
+# Per view timings and query counts on /metrics, see core.middleware.MetricsMiddleware.
+KINRO_METRICS = False
+# Where `X-Profile` requests dump cProfile stats, system temp dir when None.
+KINRO_PROFILE_DIR = None
+
+# When derived data catches up with writes: 'sync', 'thread' or 'worker', see core.models.StaleDay
+KINRO_JOBS = 'thread'
+
+# Under ASGI, threads for read views, writes go through one more, see core.pool. Reads are CPU
+# and GIL bound, more threads mostly take time away from start/stop, see tests/load_timer.py
+KINRO_READ_THREADS = 1
+
 # How many days are recent to you? Used for proposing recent buckets to re-use.
 RECENT_DAYS = 14
 
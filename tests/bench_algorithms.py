@@ -0,0 +1,44 @@
+"""
+Micro-benchmarks, not collected by default, run explicitly:
+py.test tests/bench_algorithms.py
+"""
+import random
+
+import pytest
+
+from core.algorithms import merge_overlapping_spans, merged_length
+
+pytest.importorskip('pytest_benchmark')
+
+
+def make_spans(n, seed=0):
+    """n spans of 1-120 minutes starting every ~45 minutes on average, so roughly half overlap."""
+    rnd = random.Random(seed)
+    spans = []
+    start = 0
+    for _ in range(n):
+        start += rnd.randint(0, 90 * 60)
+        spans.append((start, start + rnd.randint(60, 120 * 60)))
+    rnd.shuffle(spans)
+    return spans
+
+
+SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_merge_overlapping_spans(benchmark, n):
+    spans = make_spans(n)
+    benchmark(merge_overlapping_spans, spans)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_merge_overlapping_spans_presorted(benchmark, n):
+    spans = sorted(make_spans(n))
+    benchmark(merge_overlapping_spans, spans, presorted=True)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_merged_length_presorted(benchmark, n):
+    spans = sorted(make_spans(n))
+    benchmark(merged_length, spans, presorted=True)
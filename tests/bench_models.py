@@ -0,0 +1,52 @@
+"""
+Benchmarks against a synthetic sqlite database, not collected by default, run explicitly:
+KINRO_BENCH_SPANS=1000000 py.test tests/bench_models.py
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from core.models import Bucket, TimeSpan
+
+pytest.importorskip('pytest_benchmark')
+pytestmark = pytest.mark.django_db
+
+SPANS = int(os.environ.get('KINRO_BENCH_SPANS', 10 ** 6))
+
+
+@pytest.fixture(scope='module')
+def spans(django_db_setup, django_db_blocker):
+    """SPANS time spans, ten per day, half an hour each with a comment, spread over 5 buckets."""
+    with django_db_blocker.unblock():
+        buckets = [Bucket.objects.create(title='bench %s' % i) for i in range(5)]
+        day = datetime(2000, 1, 1, 8)
+        batch = []
+        for i in range(SPANS):
+            start = day + timedelta(days=i // 10, minutes=(i % 10) * 50)
+            batch.append(TimeSpan(
+                start=start, end=start + timedelta(minutes=30), bucket=buckets[i % 5],
+                comment='lorem ipsum dolor sit amet ' * 10,
+            ))
+            if len(batch) == 10000:
+                TimeSpan.objects.bulk_create(batch)
+                batch = []
+        TimeSpan.objects.bulk_create(batch)
+        yield TimeSpan.objects.all()
+        TimeSpan.objects.all().delete()
+        Bucket.objects.all().delete()
+
+
+def test_merged_total(benchmark, spans):
+    benchmark(spans.merged_total)
+
+
+def test_merged_total_from_instances(benchmark, spans):
+    """How merged_total used to work, for comparison."""
+    from core.algorithms import merged_length
+    benchmark(lambda: merged_length(
+        (ts.start.timestamp(), ts.get_end().timestamp()) for ts in spans.all()))
+
+
+def test_focus_factor(benchmark, spans):
+    benchmark(spans.focus_factor)
@@ -0,0 +1,74 @@
+"""
+End to end benchmarks on synthetic data, see core.synthetic. Not collected by default, run:
+    make bench
+or, with a different amount of data:
+    KINRO_BENCH_YEARS=10 py.test tests/bench_suite.py --benchmark-json=bench.json
+
+Compare runs with `py.test-benchmark compare` or `--benchmark-compare`, see make bench.
+"""
+import os
+from datetime import date
+
+import pytest
+from django.urls import reverse
+
+from core import reporting, synthetic
+from core.algorithms import merge_overlapping_spans
+from core.models import Bucket, BucketDayTotal, BucketTree, DailyTarget, DayCache, TimeSpan
+
+pytest.importorskip('pytest_benchmark')
+pytestmark = pytest.mark.django_db
+
+YEARS = float(os.environ.get('KINRO_BENCH_YEARS', 5))
+SINCE = date(2015, 1, 5)
+
+
+@pytest.fixture(scope='module')
+def data(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        synthetic.generate(int(YEARS * 365), SINCE)
+        DayCache.recalculate_all()
+        BucketTree.invalidate()
+        yield
+        for model in (DayCache, BucketDayTotal, TimeSpan, DailyTarget):
+            model.objects.all().delete()
+        # children first, parents are protected
+        for bucket in Bucket.objects.order_by('-level'):
+            bucket.delete()
+
+
+def test_merge_overlapping_spans(benchmark, data):
+    spans = list(TimeSpan.objects.values_list('start', 'end'))
+    benchmark(merge_overlapping_spans, spans)
+
+
+def test_merged_total(benchmark, data):
+    benchmark(TimeSpan.objects.all().merged_total)
+
+
+def test_recalculate_all(benchmark, data):
+    benchmark.pedantic(DayCache.recalculate_all, rounds=3)
+
+
+def test_insight_month(benchmark, data, client):
+    url = reverse('insight', args=('2015-03-01', '2015-03-31'))
+    response = benchmark(client.get, url)
+    assert response.status_code == 200
+
+
+def test_time_spans_week(benchmark, data, client):
+    def get():
+        # consume the streamed body, that's where the work is
+        response = client.get(reverse('time_spans'), {'start': '2015-03-02', 'end': '2015-03-09'})
+        return b''.join(response.streaming_content)
+    assert benchmark(get)
+
+
+def test_admin_bucket_changelist(benchmark, data, admin_client):
+    response = benchmark(admin_client.get, reverse('admin:core_bucket_changelist'))
+    assert response.status_code == 200
+
+
+def test_report_month(benchmark, data):
+    rows = benchmark(reporting.report, *reporting.month_range(2015, 3))
+    assert rows
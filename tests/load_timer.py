@@ -0,0 +1,91 @@
+"""
+Start/stop latency while dashboards poll, against a running server. Not collected by pytest.
+
+    ./manage.py synthetic_data --years 2
+    uvicorn asgi:application --port 7001 &
+    python tests/load_timer.py --url http://127.0.0.1:7001 --bucket 1 --pollers 20
+
+Every poller loads a week of spans and its insight over and over, like an open dashboard after
+every change, one client toggles a timer. Prints latency percentiles per kind of request.
+Plain asyncio, HTTP/1.0 one request per connection, no dependencies.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+
+async def request(url, method='GET', body=b''):
+    """(status, seconds)"""
+    parts = urlsplit(url)
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    writer.write((
+        '%s %s HTTP/1.0\r\nHost: %s\r\nContent-Type: application/x-www-form-urlencoded\r\n'
+        'Content-Length: %d\r\n\r\n' % (method, path, parts.netloc, len(body))
+    ).encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1]), time.perf_counter() - started
+
+
+async def poll(base, week, timings, deadline):
+    start, end = week, week + timedelta(days=7)
+    urls = [
+        '%s/time_spans/?start=%s&end=%s' % (base, start, end),
+        '%s/insight/%s/%s' % (base, start, end - timedelta(days=1)),
+    ]
+    while time.perf_counter() < deadline:
+        for url in urls:
+            status, seconds = await request(url)
+            timings['poll' if status == 200 else 'poll %d' % status].append(seconds)
+
+
+async def toggle(base, bucket, interval, timings, deadline):
+    body = ('bucket=%s' % bucket).encode()
+    while time.perf_counter() < deadline:
+        status, seconds = await request(base + '/api/timer/toggle', 'POST', body)
+        timings['start/stop' if status == 200 else 'start/stop %d' % status].append(seconds)
+        await asyncio.sleep(interval)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def main(args):
+    week = date.today() - timedelta(days=date.today().weekday())
+    timings = defaultdict(list)
+    deadline = time.perf_counter() + args.seconds
+    await asyncio.gather(
+        toggle(args.url, args.bucket, args.interval, timings, deadline),
+        *[
+            poll(args.url, week - timedelta(weeks=i % args.weeks), timings, deadline)
+            for i in range(args.pollers)
+        ]
+    )
+    print('%-14s %7s %9s %9s %9s %9s' % ('', 'n', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for kind, values in sorted(timings.items()):
+        if values:
+            print('%-14s %7d %9.1f %9.1f %9.1f %9.1f' % (
+                kind, len(values), statistics.median(values) * 1000,
+                percentile(values, 95) * 1000, percentile(values, 99) * 1000,
+                max(values) * 1000,
+            ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:7001')
+    parser.add_argument('--bucket', type=int, default=1, help='toggled bucket id')
+    parser.add_argument('--pollers', type=int, default=20, help='concurrent dashboards')
+    parser.add_argument('--weeks', type=int, default=4, help='pollers spread over past weeks')
+    parser.add_argument('--interval', type=float, default=.2, help='seconds between toggles')
+    parser.add_argument('--seconds', type=float, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -1,11 +1,16 @@
 import pytest
 
-from core.algorithms import merge_overlapping_spans
+from core.algorithms import iter_merged_spans, merge_overlapping_spans, merged_length
 
 
 @pytest.mark.parametrize('a, expected', (
     ([(4, 7), (1, 2), (5, 9), (6, 6)], [(1, 2), (4, 9)]),
     ([(-10, -5), (-11, 2), (4, 5), ], [(-11, 2), (4, 5)]),
+    ([], []),
+    ([(1, 2), (2, 3)], [(1, 3)]),
 ))
 def test_merge_overlapping_spans(a, expected):
     assert merge_overlapping_spans(a) == expected
+    assert merge_overlapping_spans(sorted(a), presorted=True) == expected
+    assert list(iter_merged_spans(iter(a))) == expected
+    assert merged_length(a) == sum(b - a for a, b in expected)
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from core import backup
+
+
+@pytest.fixture
+def database(tmpdir):
+    path = str(tmpdir.join('db.sqlite3'))
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE span (id INTEGER PRIMARY KEY, comment TEXT)')
+    db.executemany('INSERT INTO span (comment) VALUES (?)', [('x' * 100, )] * 5000)
+    db.commit()
+    db.close()
+    return path
+
+
+@pytest.mark.parametrize('vacuum', (False, True))
+def test_snapshot_and_restore(database, tmpdir, vacuum):
+    directory = str(tmpdir.join('backups'))
+    path, counts = backup.snapshot(database, directory, vacuum=vacuum)
+    assert counts == {'span': 5000}
+    assert backup.snapshots(directory) == [path]
+    db = sqlite3.connect(database)
+    db.execute('DELETE FROM span')
+    db.commit()
+    assert backup.restore(path, database) == {'span': 5000}
+    assert db.execute('SELECT COUNT(*) FROM span').fetchone() == (5000, )
+    db.close()
+
+
+def test_writers_are_not_blocked(database, tmpdir):
+    """A writer keeps inserting through the whole paged backup."""
+    done = threading.Event()
+    written, errors = [], []
+
+    def write():
+        db = sqlite3.connect(database, timeout=.5)
+        while not done.is_set():
+            try:
+                with db:
+                    db.execute("INSERT INTO span (comment) VALUES ('y')")
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+            written.append(1)
+        db.close()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        path, counts = backup.snapshot(database, str(tmpdir), pages=1, sleep=.001)
+    finally:
+        done.set()
+        writer.join()
+    assert written and not errors
+    assert counts['span'] >= 5000
+
+
+def test_damaged_snapshot(database, tmpdir):
+    path, _ = backup.snapshot(database, str(tmpdir))
+    with open(path + '.json', 'w') as f:
+        f.write('{"span": 1}')
+    with pytest.raises(backup.BackupError, match='row counts differ'):
+        backup.check(path)
+    with open(path, 'r+b') as f:
+        f.seek(0)
+        f.write(b'garbage' * 100)
+    with pytest.raises(backup.BackupError):
+        backup.verify(path)
+
+
+def test_rotate(database, tmpdir):
+    paths = [backup.snapshot(database, str(tmpdir))[0] for _ in range(3)]
+    assert backup.rotate(str(tmpdir), 2) == paths[:1]
+    assert backup.snapshots(str(tmpdir)) == paths[1:]
+    assert not os.path.exists(paths[0] + '.json')
+
+
+def test_other_files_are_not_snapshots(database, tmpdir):
+    directory = str(tmpdir.join('backups'))
+    path, _ = backup.snapshot(database, directory)
+    for name in ('db.sqlite3.2018.03.25.1521990000', 'db.sqlite3.notes', path + '.part'):
+        open(os.path.join(directory, name), 'w').close()
+    assert backup.snapshots(directory) == [path]
+    assert backup.rotate(directory, 1) == []
+    backup.snapshot(database, directory)
+    assert backup.rotate(directory, 1) == [path]
+    left = os.listdir(directory)
+    assert 'db.sqlite3.2018.03.25.1521990000' in left and 'db.sqlite3.notes' in left
+    assert path + '.part' in [os.path.join(directory, name) for name in left]
+
+
+def test_failed_copy_leaves_nothing(database, tmpdir):
+    garbage, target = str(tmpdir.join('garbage')), str(tmpdir.join('copy'))
+    with open(garbage, 'wb') as f:
+        f.write(b'garbage' * 1000)
+    with pytest.raises(sqlite3.DatabaseError):
+        backup.copy(garbage, target)
+    assert not os.path.exists(target)
+    with pytest.raises(sqlite3.DatabaseError):
+        backup.copy(garbage, database)
+    assert backup.verify(database) == {'span': 5000}
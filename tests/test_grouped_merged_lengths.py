@@ -0,0 +1,39 @@
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from core.algorithms import focus_lengths, grouped_merged_lengths, merge_overlapping_spans, np
+
+span = st.tuples(st.integers(0, 10 ** 6), st.integers(0, 10 ** 4)).map(lambda p: (p[0], sum(p)))
+rows = st.lists(st.tuples(st.sampled_from('abc'), span))
+
+
+def expected(rows):
+    groups = {}
+    for key, s in rows:
+        groups.setdefault(key, []).append(s)
+    return {
+        key: sum(b - a for a, b in merge_overlapping_spans(spans))
+        for key, spans in groups.items()
+    }
+
+
+@pytest.mark.parametrize('use_numpy', (
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(np is None, reason='numpy not installed')),
+))
+@given(rows=rows)
+def test_grouped_merged_lengths(use_numpy, rows):
+    assert grouped_merged_lengths(
+        ((key, a, b) for key, (a, b) in rows), use_numpy=use_numpy
+    ) == pytest.approx(expected(rows))
+
+
+@given(rows=st.lists(st.tuples(st.sampled_from('abc'), span, st.booleans())))
+def test_focus_lengths(rows):
+    ordered = sorted(((key, a, b, focused) for key, (a, b), focused in rows),
+                     key=lambda row: row[:2])
+    result = focus_lengths(ordered)
+    totals = expected([(key, s) for key, s, _ in rows])
+    focused = expected([(key, s) for key, s, focused in rows if focused])
+    assert result == {key: (focused.get(key, 0), total) for key, total in totals.items()}
@@ -0,0 +1,39 @@
+import pytest
+
+from core import metrics
+from core.algorithms import grouped_merged_lengths
+
+
+@pytest.fixture
+def enabled():
+    metrics.reset()
+    metrics.enabled = True
+    yield
+    metrics.enabled = False
+    metrics.reset()
+
+
+def test_histogram_exposition():
+    histogram = metrics.Histogram('x_seconds', 'Help.', 'view', buckets=(1, 5))
+    histogram.observe('a', .5)
+    histogram.observe('a', 3)
+    histogram.observe('a', 7)
+    assert histogram.exposition().splitlines() == [
+        '# HELP x_seconds Help.',
+        '# TYPE x_seconds histogram',
+        'x_seconds_bucket{view="a",le="1"} 1',
+        'x_seconds_bucket{view="a",le="5"} 2',
+        'x_seconds_bucket{view="a",le="+Inf"} 3',
+        'x_seconds_sum{view="a"} 10.5',
+        'x_seconds_count{view="a"} 3',
+    ]
+
+
+def test_timed_only_when_enabled(enabled):
+    metrics.enabled = False
+    grouped_merged_lengths([('a', 1, 2)])
+    assert 'grouped_merged_lengths' not in metrics.function_seconds.series
+    metrics.enabled = True
+    grouped_merged_lengths([('a', 1, 2)])
+    assert 'kinro_function_seconds_count{function="grouped_merged_lengths"} 1' in (
+        metrics.exposition())
@@ -0,0 +1,115 @@
+"""
+Stress: readers poll like the dashboard does, writers read then write in one transaction, like
+TimeSpan.save and DayCache.recalculate do. Plain connections, set up the way Django sets up its
+own, with and without core.sqlite.PRODUCTION. What breaks under load, read_then_write does
+deterministically, once.
+"""
+import sqlite3
+import threading
+
+import pytest
+
+from core import sqlite
+
+
+def stress(path, pragmas, begin, writers=4, readers=4, transactions=50):
+    """Errors raised by all the threads."""
+    db = sqlite3.connect(path)
+    with db:
+        db.execute('CREATE TABLE span (id INTEGER PRIMARY KEY, day INTEGER, seconds INTEGER)')
+        db.executemany(
+            'INSERT INTO span (day, seconds) VALUES (?, 60)', [(i % 30, ) for i in range(20000)])
+    db.close()
+    errors = []
+    writing = threading.Event()
+    writing.set()
+
+    def connect():
+        # Django's autocommit mode, it issues BEGIN itself, default 5s timeout
+        db = sqlite3.connect(path, isolation_level=None)
+        sqlite.apply(db.cursor(), pragmas)
+        return db
+
+    def write():
+        db = connect()
+        for i in range(transactions):
+            try:
+                db.execute(begin)
+                db.execute('SELECT SUM(seconds) FROM span WHERE day = ?', (i % 30, )).fetchone()
+                db.execute('INSERT INTO span (day, seconds) VALUES (?, 60)', (i % 30, ))
+                db.execute('COMMIT')
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+        db.close()
+
+    def read():
+        db = connect()
+        while writing.is_set():
+            try:
+                db.execute('SELECT day, SUM(seconds) FROM span GROUP BY day').fetchall()
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+        db.close()
+
+    reading = [threading.Thread(target=read) for _ in range(readers)]
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    for thread in reading + threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writing.clear()
+    for thread in reading:
+        thread.join()
+    return errors
+
+
+def read_then_write(path, pragmas, begin):
+    """Error, if any, of a transaction that reads and then writes while another connection holds
+    the write lock for a moment."""
+    db = sqlite3.connect(path)
+    with db:
+        db.execute('CREATE TABLE span (id INTEGER PRIMARY KEY, day INTEGER, seconds INTEGER)')
+    db.close()
+
+    def connect():
+        db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        sqlite.apply(db.cursor(), pragmas)
+        return db
+
+    holder, db = connect(), connect()
+    holder.execute('BEGIN IMMEDIATE')
+    holder.execute('INSERT INTO span (day, seconds) VALUES (1, 60)')
+    commit = threading.Timer(0.2, holder.execute, ('COMMIT', ))
+    commit.start()
+    try:
+        db.execute(begin)
+        db.execute('SELECT SUM(seconds) FROM span WHERE day = 1').fetchone()
+        db.execute('INSERT INTO span (day, seconds) VALUES (1, 60)')
+        db.execute('COMMIT')
+    except sqlite3.OperationalError as e:
+        return e
+    finally:
+        # the read lock it still holds would keep the holder from committing
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        commit.join()
+        db.close()
+        holder.close()
+
+
+@pytest.mark.parametrize('pragmas', ({}, sqlite.PRODUCTION))
+def test_database_is_locked(tmpdir, pragmas):
+    # a deferred transaction holds a read lock, waiting for the writer could deadlock, so SQLite
+    # doesn't, busy_timeout or not, WAL or not
+    error = read_then_write(str(tmpdir.join('db.sqlite3')), pragmas, 'BEGIN')
+    assert 'database is locked' in str(error)
+    # one that takes the write lock up front waits its turn
+    path = str(tmpdir.join('immediate.sqlite3'))
+    assert read_then_write(path, pragmas, 'BEGIN IMMEDIATE') is None
+
+
+@pytest.mark.parametrize('pragmas', ({}, sqlite.PRODUCTION))
+def test_begin_immediate_under_load(tmpdir, pragmas):
+    assert stress(str(tmpdir.join('db.sqlite3')), pragmas, 'BEGIN IMMEDIATE') == []